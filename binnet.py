@@ -0,0 +1,286 @@
+# Compact binary form of the bus network, read in place.
+#
+# Loading the json bus network parses the whole file into many small
+# objects, even when a single timetable is needed. This format keeps the
+# same content as model.py in flat tables of numbers, so the file can be
+# memory mapped and only the bytes of the buses, stations and timetables
+# actually looked up are ever read. The views returned by load have the
+# same attributes as the model.py objects, so departures.py, trips.py,
+# planner.py and model.to_json work on them as well.
+#
+# All the numbers are little endian. After the header come the sections
+# below, each starting at a multiple of 4 bytes:
+#   strings     uint32 offsets into the string data, one more than strings
+#   data        the utf-8 encoded strings, one after the other
+#   buses       uint32 name, routes 2i and 2i + 1 being its droute and rroute
+#   routes      uint32 first station, station count
+#   stations    uint32 name, first timetable, timetable count
+#   timetables  uint32 day, departures, departure count, first note,
+#               note count, order (0xffffffff if none)
+#   notes       uint32 position, text
+#   minutes     uint16, the departures and orders of all the timetables
+# Names, days and texts are indexes in the strings, departures and orders
+# are indexes in the minutes.
+
+import binascii
+import collections.abc
+import json
+import mmap
+import struct
+import sys
+from array import array
+import model
+import payload
+
+_magic = b"TSBN"
+_format = 1
+# Magic, format, network version (sha256, all zeros if unknown), update
+# string and the byte offset and record count of every section.
+_sections = ("strings", "data", "buses", "routes", "stations", "timetables", "notes", "minutes")
+_header = struct.Struct("<4sI32sI" + "II" * len(_sections))
+_none = 0xffffffff
+
+
+def dumps(network, version=None):
+    """
+    The binary form of the compact bus network (see model.from_json).
+    The version is the hash of the json it was built from, see
+    persistence.get_network_version.
+    """
+    # The strings in order, as dicts are not ordered before Python 3.7,
+    # and their indexes.
+    strings = []
+    indexes = {}
+    def string(text):
+        if text not in indexes:
+            indexes[text] = len(strings)
+            strings.append(text)
+        return indexes[text]
+    tables = {name: array('I') for name in _sections[2:-1]}
+    minutes = array('H')
+    update = string(network.update)
+    for bus in network.buses:
+        tables["buses"].append(string(bus.name))
+        for route in (bus.droute, bus.rroute):
+            tables["routes"].extend((len(tables["stations"]) // 3, len(route.stations)))
+            for station in route.stations:
+                tables["stations"].extend((string(station.name), len(tables["timetables"]) // 6,
+                                           len(station.timetables)))
+                for timetable in station.timetables:
+                    tables["timetables"].extend((string(timetable.day), len(minutes),
+                                                 len(timetable.departures),
+                                                 len(tables["notes"]) // 2, len(timetable.notes)))
+                    minutes.extend(timetable.departures)
+                    if timetable.order is None:
+                        tables["timetables"].append(_none)
+                    else:
+                        tables["timetables"].append(len(minutes))
+                        minutes.extend(timetable.order)
+                    for position, text in timetable.notes:
+                        tables["notes"].extend((position, string(text)))
+    data = [text.encode('utf-8') for text in strings]
+    offsets = array('I', [0])
+    for encoded in data:
+        offsets.append(offsets[-1] + len(encoded))
+    tables["strings"] = offsets
+    tables["data"] = b"".join(data)
+    tables["minutes"] = minutes
+    body = []
+    sections = []
+    size = _header.size
+    for name in _sections:
+        table = tables[name]
+        if isinstance(table, array):
+            if sys.byteorder != 'little':
+                table.byteswap()
+            table = table.tobytes()
+        sections += [size, len(tables[name]) if name != "strings" else len(data)]
+        padding = -len(table) % 4
+        body.append(table + b"\0" * padding)
+        size += len(table) + padding
+    version = bytes.fromhex(version) if version else bytes(32)
+    return _header.pack(_magic, _format, version, update, *sections) + b"".join(body)
+
+def load(path):
+    """
+    Memory map the binary bus network file. Returns a view of the network,
+    see Network.
+    """
+    with open(path, 'rb') as f:
+        return loads(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+def loads(buffer):
+    """
+    View of the binary bus network in the buffer, see Network.
+    """
+    return Network(buffer)
+
+
+class Network(object):
+    """
+    The bus network, read from the buffer on demand. Also has the version
+    of the json it was built from (None if unknown).
+    """
+    __slots__ = ("version", "_update", "_bytes", "_u32", "_u16", "_at", "_strings")
+
+    def __init__(self, buffer):
+        if sys.byteorder != 'little':
+            raise ValueError("the binary bus network can only be read on little endian machines")
+        fields = _header.unpack_from(buffer)
+        if fields[0] != _magic or fields[1] != _format:
+            raise ValueError("not a binary bus network")
+        self.version = binascii.hexlify(fields[2]).decode() if any(fields[2]) else None
+        self._update = fields[3]
+        self._bytes = memoryview(buffer)
+        self._u32 = self._bytes.cast('I')
+        self._u16 = self._bytes.cast('H')
+        # Where every section starts, in units of its own items.
+        offsets = fields[4::2]
+        self._at = {name: offset // (2 if name == "minutes" else 1 if name == "data" else 4)
+                    for name, offset in zip(_sections, offsets)}
+        self._at["bus count"] = fields[4 + 2 * _sections.index("buses") + 1]
+        self._strings = {}
+
+    @property
+    def update(self):
+        return self._string(self._update)
+
+    @property
+    def buses(self):
+        return _Table(self, Bus, 0, self._at["bus count"])
+
+    def bus(self, name):
+        """
+        The bus with the given name, or None.
+        """
+        for bus in self.buses:
+            if bus.name == name:
+                return bus
+        return None
+
+    def _record(self, section, index, size, count=1):
+        # The uint32 fields of count records of the given size.
+        start = self._at[section] + index * size
+        return self._u32[start:start + size * count]
+
+    def _string(self, index):
+        # The same names are asked for over and over again.
+        if index not in self._strings:
+            at = self._at["strings"] + index
+            start, end = self._u32[at], self._u32[at + 1]
+            data = self._at["data"] + start
+            self._strings[index] = sys.intern(bytes(self._bytes[data:data + end - start]).decode('utf-8'))
+        return self._strings[index]
+
+
+class _Table(collections.abc.Sequence):
+    # Consecutive records of a section, viewed as the given class.
+    __slots__ = ("_network", "_view", "_first", "_count")
+
+    def __init__(self, network, view, first, count):
+        self._network = network
+        self._view = view
+        self._first = first
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return self._view(self._network, self._first + index)
+
+    def __iter__(self):
+        for index in range(self._first, self._first + self._count):
+            yield self._view(self._network, index)
+
+
+class Bus(object):
+    __slots__ = ("_network", "_index")
+
+    def __init__(self, network, index):
+        self._network = network
+        self._index = index
+
+    @property
+    def name(self):
+        return self._network._string(self._network._record("buses", self._index, 1)[0])
+
+    @property
+    def droute(self):
+        return Route(self._network, 2 * self._index, "droute")
+
+    @property
+    def rroute(self):
+        return Route(self._network, 2 * self._index + 1, "rroute")
+
+
+class Route(object):
+    __slots__ = ("_network", "_index", "direction")
+
+    def __init__(self, network, index, direction):
+        self._network = network
+        self._index = index
+        self.direction = direction
+
+    @property
+    def stations(self):
+        first, count = self._network._record("routes", self._index, 2)
+        return _Table(self._network, Station, first, count)
+
+
+class Station(object):
+    __slots__ = ("_network", "_index")
+
+    def __init__(self, network, index):
+        self._network = network
+        self._index = index
+
+    @property
+    def name(self):
+        return self._network._string(self._network._record("stations", self._index, 3)[0])
+
+    @property
+    def timetables(self):
+        name, first, count = self._network._record("stations", self._index, 3)
+        return _Table(self._network, Timetable, first, count)
+
+
+class Timetable(object):
+    # The departures and order are memoryviews of the minutes.
+    __slots__ = ("day", "departures", "notes", "order")
+
+    def __init__(self, network, index):
+        day, first, count, note, notes, order = network._record("timetables", index, 6)
+        minutes = network._at["minutes"]
+        self.day = network._string(day)
+        self.departures = network._u16[minutes + first:minutes + first + count]
+        self.notes = tuple((position, network._string(text))
+                           for position, text in zip(*[iter(network._record("notes", note, 2, notes))] * 2))
+        self.order = None
+        if order != _none:
+            self.order = network._u16[minutes + order:minutes + order + count]
+
+
+def convert(source, destination):
+    """
+    Convert a json bus network file to the binary form, or the other way
+    around, depending on the extension of the source.
+    """
+    with open(source, 'rb') as f:
+        content = f.read()
+    if source.endswith(".json"):
+        result = dumps(model.from_json(json.loads(content.decode('utf-8'))), payload.digest(content))
+    else:
+        result = json.dumps(model.to_json(loads(content))).encode('utf-8')
+    with open(destination, 'wb') as f:
+        f.write(result)
+
+if __name__ == '__main__':
+    # python binnet.py bus_network.json bus_network.bin, or the other way around.
+    convert(sys.argv[1], sys.argv[2])
@@ -0,0 +1,80 @@
+# Departures board of every station: the departures of all the buses
+# stopping there, in both directions, merged and sorted by time, for each
+# kind of day. Kept on disk next to the bus network (see persistence), so
+# the next buses from a station are found without going through the
+# timetables of the whole bus network.
+#
+# A board is built from parts, one for every bus, with the departures of
+# that bus from each of its stations. Parts only change with their bus,
+# so after an update only the stations of the buses that changed are
+# merged again.
+
+import bisect
+
+# The timetable names valid on weekdays, saturdays and sundays.
+day_types = {"weekdays": ("Luni - Vineri", "Luni - Duminica"),
+             "saturdays": ("Sambata", "Luni - Duminica"),
+             "sundays": ("Duminica", "Luni - Duminica")}
+
+# The kind of day of the given date.
+def day_type(date):
+    weekday = date.weekday()
+    if weekday < 5:
+        return "weekdays"
+    if weekday == 5:
+        return "saturdays"
+    return "sundays"
+
+# Minutes since midnight for a "HH:MM" string, None for anything else.
+def minutes(hour):
+    try:
+        hours, minutes = hour.split(":")
+        return int(hours) * 60 + int(minutes)
+    except ValueError:
+        return None
+
+# The part of the bus: for every station name, the (bus name, direction,
+# {day type: sorted minutes}) of every stop of the bus there.
+def part(bus):
+    result = {}
+    for direction in ("droute", "rroute"):
+        for station in bus[direction]:
+            timetables = dict(station['timetable'])
+            days = {}
+            for day, names in day_types.items():
+                for name in names:
+                    if name in timetables:
+                        days[day] = sorted(minute for minute in map(minutes, timetables[name])
+                                           if minute is not None)
+                        break
+            result.setdefault(station['name'], []).append([bus['name'], direction, days])
+    return result
+
+# Merge the stops of the parts at the station into its board: the
+# (bus name, direction) of every route stopping there ("routes") and for
+# every day type the departures sorted by time ("minutes") together with
+# the index of their route ("route"). Departures at the same time are
+# ordered by bus name and direction.
+def merge(station_name, stops):
+    board = {"station": station_name, "routes": []}
+    departures = dict((day, []) for day in day_types)
+    for bus_name, direction, days in sorted(stops, key=lambda stop: stop[:2]):
+        route = len(board["routes"])
+        board["routes"].append([bus_name, direction])
+        for day, day_minutes in days.items():
+            departures[day].extend((minute, route) for minute in day_minutes)
+    for day, day_departures in departures.items():
+        day_departures.sort()
+        board[day] = {"minutes": [minute for minute, route in day_departures],
+                      "route": [route for minute, route in day_departures]}
+    return board
+
+# The first departures from the board at or after the given datetime and
+# on the same day. Returns at most limit (minute, bus name, direction)
+# tuples, sorted by time.
+def next_departures(board, when, limit=5):
+    day = board[day_type(when)]
+    start = bisect.bisect_left(day["minutes"], when.hour * 60 + when.minute)
+    return [(minute, board["routes"][route][0], board["routes"][route][1])
+            for minute, route in zip(day["minutes"][start:start + limit],
+                                     day["route"][start:start + limit])]
@@ -5,8 +5,24 @@
 import persistence
 import tsbweb
 import logging
+import board
+import collections
 
 _bus_network = {}
+# The bus names and the station names of their routes, enough for the
+# first screens (see persistence.get_snapshot), and these by bus name.
+_snapshot = {}
+_routes = {}
+# Lookup tables over the buses loaded so far, either one at a time or
+# all at once with the bus network.
+# Bus name to bus and (bus name, direction, station name) to timetable.
+_buses = {}
+_timetables = {}
+# Formatted timetables and route names, by (bus name, direction, station
+# name), the station name being None for route names. Only the last
+# cache_size ones used are kept.
+cache_size = 64
+_formatted = collections.OrderedDict()
 
 # Only returns true if the bus network information
 # has already been downloaded from the web on the
@@ -18,32 +34,74 @@ def bus_network_exists():
 # the web. This should be called the very first time
 # the app is running after installation. Can also
 # be called in case an update is needed.
-def request_bus_network():
-    tsbweb.request_bus_network()
+# The download happens in the background, on_done(saved)
+# is called once it is over, see tsbweb.request_bus_network.
+def request_bus_network(on_done=None, on_progress=None):
+    def done(saved):
+        if saved:
+            _forget_bus_network()
+        if on_done:
+            on_done(saved)
+    tsbweb.request_bus_network(done, on_progress)
 
 # Return the bus network in one single dictionary.
 # Returns a local cached value if the function was
-# already called before.
+# already called before, or None if the bus network
+# was not downloaded yet (see request_bus_network).
 def bus_network():
     global _bus_network
     if _bus_network:
         return _bus_network
     try:
          _bus_network = persistence.get_bus_network()
-         return _bus_network
     except:
-        try:
-            tsbweb.request_bus_network()
-            return persistence.get_bus_network()
-        except:
-            # Gotta try again later, somehow.
-            pass
+        # Gotta try again later, somehow.
+        return None
+    _build_indexes()
+    return _bus_network
+
+def _build_indexes():
+    _buses.clear()
+    _timetables.clear()
+    for bus in _bus_network['buses']:
+        _index_bus(bus)
+
+def _index_bus(bus):
+    _buses.setdefault(bus['name'], bus)
+    for direction in ("droute", "rroute"):
+        for station in bus[direction]:
+            _timetables.setdefault((bus['name'], direction, station['name']),
+                                   station['timetable'])
+
+# The snapshot of the bus network, or None if the bus network
+# was not downloaded yet.
+def _startup_snapshot():
+    global _snapshot
+    if _snapshot:
+        return _snapshot
+    try:
+        _snapshot = persistence.get_snapshot()
+    except:
+        return None
+    for bus in _snapshot['buses']:
+        _routes.setdefault(bus['name'], bus)
+    return _snapshot
+
+# A new bus network was saved, load it on next use.
+def _forget_bus_network():
+    global _bus_network, _snapshot
+    _bus_network = {}
+    _snapshot = {}
+    _routes.clear()
+    _buses.clear()
+    _timetables.clear()
+    _formatted.clear()
 
 # Returns all the buses names.
 def bus_names():
     result = []
     try:
-        buses = bus_network()['buses']
+        buses = _startup_snapshot()['buses']
         for bus in buses:
             result.append(bus['name'])
         return result
@@ -53,28 +111,26 @@ def bus_names():
 # Get the update string available locally on the device.
 def update_string_local():
     try:
-        return bus_network()['update']
+        return _startup_snapshot()['update']
     except:
         return ""
 
 # Get the update string available from the tursib.ro page.
-def update_string_web():
-    return tsbweb.request_update_string()
+# callback(update_string) is called once it arrives.
+def update_string_web(callback):
+    tsbweb.request_update_string(callback)
 
 # Return all the info for the bus with this name.
+# Only this bus is loaded, if the bus network was not already.
 def _bus_info(bus_name):
-    buses = bus_network()['buses']
-    for idx, bus in enumerate(buses):
-        if bus['name'] == bus_name:
-            return buses[idx]
-    return []
-
-# Return all the info for the given station name on this route.
-def _station_info(route, station_name):
-    for idx, station in enumerate(route):
-        if station['name'] == station_name:
-            return route[idx]
-    return []
+    if bus_name not in _buses:
+        try:
+            bus = persistence.get_bus(bus_name)
+        except:
+            bus = None
+        if bus:
+            _index_bus(bus)
+    return _buses.get(bus_name, [])
 
 # Direct route names for the given bus.
 def droute_names(bus_name):
@@ -85,12 +141,23 @@ def rroute_names(bus_name):
     return _route_names(bus_name, "rroute")
 
 # Return a list of all station names for the given bus.
+# The list is shared, it must not be modified.
 def _route_names(bus_name, direction):
-    result = []
-    bus = _bus_info(bus_name)
-    for station in bus[direction]:
-        result.append(station['name'])
-    return result
+    def names():
+        _startup_snapshot()
+        return list(_routes.get(bus_name, {}).get(direction, []))
+    return _cached((bus_name, direction, None), names)
+
+# The value for the key, built only if not among the last ones used.
+def _cached(key, build):
+    if key in _formatted:
+        _formatted[key] = _formatted.pop(key)
+        return _formatted[key]
+    value = build()
+    _formatted[key] = value
+    while len(_formatted) > cache_size:
+        _formatted.popitem(last=False)
+    return value
 
 # Returns the timetable for the given unique station.
 def timetable(bus_name, station_name, direction):
@@ -98,13 +165,17 @@ def timetable(bus_name, station_name, direction):
     if not bus:
         logging.error("tsbapp - \"{}\" bus name does not exist".format(bus_name))
         return []
-    station = _station_info(bus[direction], station_name)
-    if not station:
+    station_timetable = _timetables.get((bus_name, direction, station_name))
+    if station_timetable is None:
         logging.error("tsbapp - \"{}\" station name does not exist".format(station_name))
         return []
-    return station['timetable']
+    return station_timetable
 
 def formated_timetable(bus_name, station_name, direction):
+    return _cached((bus_name, direction, station_name),
+                   lambda: _format_timetable(bus_name, station_name, direction))
+
+def _format_timetable(bus_name, station_name, direction):
     ttable = timetable(bus_name, station_name, direction)
     formated = "______\n\n"
     for idx, item in enumerate(ttable):
@@ -113,3 +184,14 @@ def formated_timetable(bus_name, station_name, direction):
         formated += ttable_name
         formated += ttable_content
     return formated
+
+# The next departures from the given station, for all the buses,
+# at or after the given datetime and on the same day. Returns at
+# most limit (time, bus name, direction) tuples, sorted by time.
+# Only the departures board of the station is loaded (see board).
+def next_departures(station_name, when, limit=5):
+    station_board = persistence.get_board(station_name)
+    if station_board is None:
+        return []
+    return [("{:02d}:{:02d}".format(minute // 60, minute % 60), bus_name, direction)
+            for minute, bus_name, direction in board.next_departures(station_board, when, limit)]
@@ -8,6 +8,7 @@ from kivy.adapters.listadapter import ListAdapter
 from kivy.core.window import Window
 from kivy.graphics import Color, Rectangle
 from scrollable import ScrollableLabel
+import datetime
 import data
 
 # Keep track of the root object.
@@ -20,14 +21,34 @@ class TsbApp(App):
     selected_station = None
     # Diferentiate between the direct and reverse routes.
     selected_direction = "droute"
+    # Whether a bus network is being downloaded, and the label showing
+    # how that goes while there is no bus network to show yet.
+    downloading = False
+    progress = None
+    # The screens are built once and shown again on every navigation,
+    # by name. The one shown gets the back button presses.
+    screens = {}
+    screen = None
 
     def build(self):
         global tsb_app; tsb_app = self
+        self.screens = {}
         self._set_background_color()
-        self._check_bus_network()
+        Window.bind(on_keyboard=self.on_back_button)
+        # Show what is available locally right away, a newer bus
+        # network is swapped in once downloaded.
         self.show_buses()
+        self._check_bus_network()
         return self.content
 
+    def on_stop(self):
+        Window.unbind(on_keyboard=self.on_back_button)
+
+    def on_back_button(self, window, key, *args):
+        if key == 27 and self.screen is not None:
+            return self.screen.back()
+        return False
+
     def _set_background_color(self):
         """
         http://kivy.org/docs/guide/widgets.html#adding-a-background-to-a-layout
@@ -43,28 +64,77 @@ class TsbApp(App):
 
     def _check_bus_network(self):
         if not data.bus_network_exists():
-            data.request_bus_network()
+            self._request_bus_network()
             return
+        data.update_string_web(self._check_update_string)
+
+    def _check_update_string(self, update_string_web):
         # No info can be returned from web (no internet connection, for example)
         # or bus network info is not available from the device.
-        if not data.update_string_web() or not data.update_string_local():
+        update_string_local = data.update_string_local()
+        if not update_string_web or not update_string_local:
             return
         # A new bus network is available on tursib.ro.
-        if data.update_string_web() != data.update_string_local():
-            data.request_bus_network()
+        if update_string_web != update_string_local:
+            self._request_bus_network()
+
+    def _request_bus_network(self):
+        self.downloading = True
+        data.request_bus_network(self._bus_network_updated, self._show_progress)
+        if not data.bus_network_exists():
+            # Show the download progress instead of the missing buses.
+            self.show_buses()
+
+    def _bus_network_updated(self, saved):
+        self.downloading = False
+        # The screens are built again for the new bus network, the
+        # one shown now only when next shown.
+        if saved:
+            self.screens.clear()
+        if self.selected_bus is None:
+            self.show_buses()
+
+    def _show_progress(self, current, total):
+        if self.progress is None:
+            return
+        if total > 0:
+            self.progress.text = "Se descarca baza de date cu autobuze... {}%".format(current * 100 // total)
+        else:
+            self.progress.text = "Se descarca baza de date cu autobuze... {} KB".format(current // 1024)
 
     def show_buses(self):
-        self.content.clear_widgets()
-        self.content.add_widget(MyLabel(text="[b]{}[/b]".format("Orar Tursib")))
-        self.content.add_widget(BusesList())
+        self.selected_bus = None
+        self.progress = None
+        buses = self.screens.get("buses")
+        if buses is None:
+            buses = BusesList()
+            # Kept only once there are buses to show.
+            if buses.complete:
+                self.screens["buses"] = buses
+        self._show(buses)
 
     def show_stations(self):
-        self.content.clear_widgets()
-        self.content.add_widget(StationsList(self.selected_bus))
+        if "stations" not in self.screens:
+            self.screens["stations"] = StationsList()
+        self.screens["stations"].show(self.selected_bus)
+        self._show(self.screens["stations"])
 
     def show_timetable(self):
+        if "timetable" not in self.screens:
+            self.screens["timetable"] = TimetableList()
+        self.screens["timetable"].show(self.selected_bus, self.selected_station, self.selected_direction)
+        self._show(self.screens["timetable"])
+
+    def show_next_departures(self):
+        if "next" not in self.screens:
+            self.screens["next"] = NextDepartures()
+        self.screens["next"].show(self.selected_station)
+        self._show(self.screens["next"])
+
+    def _show(self, screen):
         self.content.clear_widgets()
-        self.content.add_widget(TimetableList(self.selected_bus, self.selected_station, self.selected_direction))
+        self.content.add_widget(screen)
+        self.screen = screen
 
 
 # Standard button to be used throughout the application.
@@ -79,22 +149,26 @@ class BusesList(BoxLayout):
     def __init__(self, **kwargs):
         super(BusesList, self).__init__(**kwargs)
         self.orientation = "vertical"
+        self.add_widget(MyLabel(text="[b]{}[/b]".format("Orar Tursib")))
         # Try to retrieve the buses list.
         buses_list = data.bus_names()
-        if not buses_list:
-            tsb_app.content.add_widget(ScrollableLabel(text="""Baza de date cu autobuze nu a putut fi gasita.
+        self.complete = bool(buses_list)
+        if not buses_list and tsb_app.downloading:
+            # Still downloading, see TsbApp._show_progress.
+            tsb_app.progress = MyLabel(text="Se descarca baza de date cu autobuze...")
+            self.add_widget(tsb_app.progress)
+        elif not buses_list:
+            self.add_widget(ScrollableLabel(text="""Baza de date cu autobuze nu a putut fi gasita.
 Va rugam verificati accesul la internet si reporniti aplicatia."""))
         else:
+            # Nothing stays selected when coming back to the screen.
             self.add_widget(ListView(
-                adapter=ListAdapter(data=buses_list, cls=BusButton)))
-        Window.bind(on_keyboard=self.on_back_button)
+                adapter=ListAdapter(data=buses_list, cls=BusButton, selection_mode="none")))
 
-    # Rebind the back button to exit the application.
-    def on_back_button(self, window, key, *args):
-        if key == 27:
-            App.get_running_app().stop()
-            return True
-        return False
+    # The back button exits the application.
+    def back(self):
+        App.get_running_app().stop()
+        return True
 
 
 class BusButton(ListItemButton, MyButton):
@@ -108,65 +182,54 @@ class BusButton(ListItemButton, MyButton):
 
 
 class StationsList(BoxLayout):
-    def __init__(self, selected_bus, **kwargs):
+    def __init__(self, **kwargs):
         super(StationsList, self).__init__(**kwargs)
-        self.selected_bus = selected_bus
+        self.selected_bus = None
+        self.direction = None
         self.orientation = "vertical"
-        self.show_stations()
-        Window.bind(on_keyboard=self.on_back_button)
-
-    def show_stations(self):
-        self.clear_widgets()
-        box_layout = BoxLayout(orientation="vertical")
         # Display the selected bus at the top of the page.
-        box_layout.add_widget(MyLabel(text="[b]{}[/b]".format(self.selected_bus)))
-
-        d_btn_state = "normal"
-        r_btn_state = "normal"
-        # Station names depending on the direct/reverse selection.
-        route_names = None
-        if tsb_app.selected_direction == "droute":
-            route_names = data.droute_names(self.selected_bus)
-            d_btn_state = "down"
-        elif tsb_app.selected_direction == "rroute":
-            route_names = data.rroute_names(self.selected_bus)
-            r_btn_state = "down"
-
+        self.bus_label = MyLabel()
+        self.add_widget(self.bus_label)
         # Make it possible to select the route (direct or reverse).
-        box_layout.add_widget(self.selection_buttons(d_btn_state, r_btn_state))
-
-        # Display routes as a list.
-        route = ListView(adapter=ListAdapter(data=route_names, 
-                                             cls=StationButton))     
-        box_layout.add_widget(route)
-        self.add_widget(box_layout)
-
-    def selection_buttons(self, d_btn_state, r_btn_state):
-        direct_btn = MyButton(text="Dus", on_press=self.direct_selected, state=d_btn_state)
-        reverse_btn = MyButton(text="Intors", on_press=self.reverse_selected, state=r_btn_state)
+        self.direct_btn = MyButton(text="Dus", on_press=self.direct_selected)
+        self.reverse_btn = MyButton(text="Intors", on_press=self.reverse_selected)
         selection_btns = BoxLayout(size_hint_y=None, height="50dp")
-        selection_btns.add_widget(direct_btn)
-        selection_btns.add_widget(reverse_btn)
-        return selection_btns
+        selection_btns.add_widget(self.direct_btn)
+        selection_btns.add_widget(self.reverse_btn)
+        self.add_widget(selection_btns)
+        # Display routes as a list.
+        self.route = ListView(adapter=ListAdapter(data=[], cls=StationButton, selection_mode="none"))
+        self.add_widget(self.route)
+
+    # Only what changed since the screen was last shown is updated.
+    def show(self, selected_bus):
+        if selected_bus == self.selected_bus and tsb_app.selected_direction == self.direction:
+            return
+        self.selected_bus = selected_bus
+        self.direction = tsb_app.selected_direction
+        self.bus_label.text = "[b]{}[/b]".format(self.selected_bus)
+        self.direct_btn.state = "down" if self.direction == "droute" else "normal"
+        self.reverse_btn.state = "down" if self.direction == "rroute" else "normal"
+        # Station names depending on the direct/reverse selection.
+        if self.direction == "droute":
+            self.route.adapter.data = data.droute_names(self.selected_bus)
+        else:
+            self.route.adapter.data = data.rroute_names(self.selected_bus)
 
     # Direct route selected by user.
     def direct_selected(self, instance):
         tsb_app.selected_direction = "droute"
-        self.show_stations()
+        self.show(self.selected_bus)
 
     # Reverse route selected by user.
     def reverse_selected(self, instance):
         tsb_app.selected_direction = "rroute"
-        self.show_stations()
+        self.show(self.selected_bus)
 
-    def on_back_button(self, window, key, *args):
-        if key == 27:
-            self.show_buses()
-            return True
-        return False
-
-    def show_buses(self):
+    def back(self):
         tsb_app.show_buses()
+        return True
+
 
 class StationButton(ListItemButton, MyButton):
     def __init__(self, **kwargs):
@@ -179,34 +242,58 @@ class StationButton(ListItemButton, MyButton):
 
         
 class TimetableList(BoxLayout):
-    def __init__(self, bus, station, direction, **kwargs):
+    def __init__(self, **kwargs):
         super(TimetableList, self).__init__(**kwargs)
         self.orientation = "vertical"
-        self.bus = bus
-        self.station = station
-        self.direction = direction
-        box_layout = BoxLayout(orientation="vertical")
-
         # Display the bus and station name at the top of the page.
-        box_layout.add_widget(MyLabel(text="[b]{}[/b]".format(self.bus)))
-        box_layout.add_widget(MyLabel(text="[b]{}[/b]".format(self.station)))
-        box_layout.add_widget(ScrollableLabel(text=self.timetable(), 
-                                              markup=True))
-
-        self.add_widget(box_layout)
-        Window.bind(on_keyboard=self.on_back_button)
+        self.bus_label = MyLabel()
+        self.station_label = MyLabel()
+        self.timetable_label = ScrollableLabel(markup=True)
+        self.add_widget(self.bus_label)
+        self.add_widget(self.station_label)
+        self.add_widget(self.timetable_label)
+        # All the buses leaving next from this station.
+        self.add_widget(MyButton(text="Urmatoarele autobuze",
+                                 on_press=lambda instance: tsb_app.show_next_departures()))
+
+    def show(self, bus, station, direction):
+        self.bus_label.text = "[b]{}[/b]".format(bus)
+        self.station_label.text = "[b]{}[/b]".format(station)
+        self.timetable_label.text = data.formated_timetable(bus, station, direction)
+        # Start from the top for every timetable.
+        self.timetable_label.scroll_y = 1
+
+    def back(self):
+        tsb_app.show_stations()
+        return True
 
-    def timetable(self):
-        return data.formated_timetable(self.bus, self.station, self.direction)
 
-    def on_back_button(self, window, key, *args):
-        if key == 27:
-            self.show_stations()
-            return True
-        return False
+# The next buses leaving from the station, whatever the bus and direction.
+class NextDepartures(BoxLayout):
+    def __init__(self, **kwargs):
+        super(NextDepartures, self).__init__(**kwargs)
+        self.orientation = "vertical"
+        self.station_label = MyLabel()
+        self.departures_label = ScrollableLabel(markup=True)
+        self.add_widget(MyLabel(text="[b]{}[/b]".format("Urmatoarele autobuze")))
+        self.add_widget(self.station_label)
+        self.add_widget(self.departures_label)
+
+    # Shown again every time, as the next buses change with the time.
+    def show(self, station):
+        self.station_label.text = "[b]{}[/b]".format(station)
+        departures = data.next_departures(station, datetime.datetime.now(), limit=10)
+        if not departures:
+            self.departures_label.text = "Nu mai pleaca niciun autobuz azi."
+        else:
+            self.departures_label.text = "\n\n".join(
+                "[b]{}[/b]  {} ({})".format(hour, bus, "Dus" if direction == "droute" else "Intors")
+                for hour, bus, direction in departures)
+        self.departures_label.scroll_y = 1
 
-    def show_stations(self):
-        tsb_app.show_stations()
+    def back(self):
+        tsb_app.show_timetable()
+        return True
 
 
 # Standard label to be used throughout the application.
@@ -1,26 +1,267 @@
+import hashlib
 import json
 import os
 import logging
-from kivy.storage.jsonstore import JsonStore
+import board
 
-def save_bus_network(bus_network):
+# The bus network is kept as one file per bus, a shard, named after the
+# hash of its content, plus a manifest listing the buses in order with
+# the hash of their shard and the station names of their routes. Only
+# the changes since the saved version (see apply_bus_network_delta) or
+# the shards whose hash changed are downloaded again (see tsbweb), and
+# only the shards of the buses looked at are loaded. The manifest is
+# also enough for the first screens (see get_snapshot).
+# The departures board of every station is kept as well, see board.py.
+
+def save_bus_network(bus_network, version=None):
     data = json.loads(bus_network.decode()) if not isinstance(bus_network, dict) else bus_network
-    with open(_bus_network_file(), "w") as f:
-        f.write(json.dumps(data))
+    shards = {}
+    buses = []
+    for bus in data['buses']:
+        shard = _dumps(bus)
+        shards[_hash(shard)] = shard
+        buses.append({"name": bus['name'], "hash": _hash(shard)})
+    save_shards({"update": data['update'], "version": version, "buses": buses}, shards)
+
+# Apply the changes received from the server (see /busnetwork/delta) to
+# the local bus network and save the result. Buses given by name only did
+# not change and keep their shard, the others get a new one, where the
+# stations given by their position in the same route of the old bus did
+# not change.
+def apply_bus_network_delta(delta):
+    data = json.loads(delta.decode()) if not isinstance(delta, dict) else delta
+    old = {}
+    for bus in get_snapshot()['buses']:
+        old[bus['name']] = bus
+    shards = {}
+    buses = []
+    for bus in data['buses']:
+        if not isinstance(bus, dict):
+            buses.append({"name": bus, "hash": old[bus]['hash']})
+            continue
+        old_bus = json.loads(_read(old[bus['name']]['hash'])) if bus['name'] in old else {"droute": [], "rroute": []}
+        shard = _dumps({"name": bus['name'],
+                        "droute": _apply_route_delta(old_bus['droute'], bus['droute']),
+                        "rroute": _apply_route_delta(old_bus['rroute'], bus['rroute'])})
+        shards[_hash(shard)] = shard
+        buses.append({"name": bus['name'], "hash": _hash(shard)})
+    save_shards({"update": data['update'], "version": data['to'], "buses": buses}, shards)
+
+def _apply_route_delta(old_route, route):
+    result = []
+    for station in route:
+        result.append(old_route[station] if isinstance(station, int) else station)
+    return result
+
+# The buses in the manifest (see /busnetwork/manifest) whose shard
+# is not stored locally, and must be downloaded.
+def missing_shards(manifest):
+    return [bus for bus in manifest['buses'] if not os.path.exists(_shard_file(bus['hash']))]
+
+# Save the new shards, given by their hash, and then the manifest.
+# The shards no longer in the manifest are removed.
+def save_shards(manifest, shards):
+    if not os.path.isdir(_shards_dir()):
+        os.makedirs(_shards_dir())
+    for shard_hash, shard in shards.items():
+        if _hash(shard) != shard_hash:
+            raise ValueError("shard {} does not match its hash".format(shard_hash))
+        _write(_shard_file(shard_hash), shard)
+    old = {}
+    if os.path.exists(_manifest_file()):
+        for bus in get_snapshot()['buses']:
+            old[bus['hash']] = bus
+    # The boards are only up to date with the saved manifest if they
+    # were all merged for it, otherwise they are all merged again.
+    merged = {} if _boards_pending() else old
+    buses = []
+    for bus in manifest['buses']:
+        if bus['hash'] in old:
+            buses.append(old[bus['hash']])
+            continue
+        routes = json.loads(_read(bus['hash']))
+        buses.append({"name": bus['name'], "hash": bus['hash'],
+                      "droute": [station['name'] for station in routes['droute']],
+                      "rroute": [station['name'] for station in routes['rroute']]})
+    snapshot = {"update": manifest['update'], "version": manifest.get('version'), "buses": buses}
+    _mark_boards_pending()
+    # Written last, so the manifest never lists a missing shard.
+    _write(_manifest_file(), json.dumps(snapshot).encode('utf-8'))
+    kept = set(bus['hash'] + ".json" for bus in buses)
+    for name in os.listdir(_shards_dir()):
+        if name not in kept:
+            os.remove(os.path.join(_shards_dir(), name))
+    _save_boards(merged, buses)
+
+# Build the missing parts and merge again the boards of the stations of
+# the buses added or removed since `old`, the buses the boards were last
+# merged for, by hash. All the boards are merged again if `old` is empty.
+def _save_boards(old, buses):
+    hashes = set(bus['hash'] for bus in buses)
+    changed = set()
+    for bus in buses:
+        if not os.path.exists(_part_file(bus['hash'])):
+            part = board.part(json.loads(_read(bus['hash'])))
+            _write(_part_file(bus['hash']), json.dumps(part).encode('utf-8'))
+        if bus['hash'] not in old:
+            changed.update(bus['droute'] + bus['rroute'])
+    for shard_hash, bus in old.items():
+        if shard_hash not in hashes:
+            changed.update(bus['droute'] + bus['rroute'])
+    parts = {}
+    for station_name in changed:
+        station_board = _merge_board(station_name, buses, parts)
+        if station_board is None:
+            # No bus stops there anymore.
+            if os.path.exists(_board_file(station_name)):
+                os.remove(_board_file(station_name))
+            continue
+        _write(_board_file(station_name), json.dumps(station_board).encode('utf-8'))
+    if not old:
+        # Boards of the stations no bus stops at anymore.
+        kept = set(os.path.basename(_board_file(station_name)) for station_name in changed)
+        for name in os.listdir(_boards_dir()):
+            if name.endswith(".json") and name not in kept:
+                os.remove(os.path.join(_boards_dir(), name))
+    kept = set(shard_hash + ".json" for shard_hash in hashes)
+    for name in os.listdir(_parts_dir()):
+        if name not in kept:
+            os.remove(os.path.join(_parts_dir(), name))
+    os.remove(_pending_file())
+
+# Whether the boards are not merged for the saved manifest: never merged,
+# or the app was killed while merging them.
+def _boards_pending():
+    return os.path.exists(_pending_file()) or not os.path.isdir(_parts_dir())
 
+# Until the boards are merged for the manifest about to be saved.
+def _mark_boards_pending():
+    if not os.path.isdir(_parts_dir()):
+        os.makedirs(_parts_dir())
+    _write(_pending_file(), b"")
+
+# The board of the station from the parts of the buses stopping there,
+# or None if no bus stops there. The parts loaded are kept in `parts`.
+def _merge_board(station_name, buses, parts):
+    stops = []
+    for bus in buses:
+        if station_name in bus['droute'] or station_name in bus['rroute']:
+            if bus['hash'] not in parts:
+                with open(_part_file(bus['hash']), "r") as f:
+                    parts[bus['hash']] = json.load(f)
+            stops.extend(parts[bus['hash']].get(station_name, []))
+    if not stops:
+        return None
+    return board.merge(station_name, stops)
+
+# The departures board of the station, see board.merge, or None if no
+# bus stops there. Only this station is loaded.
+def get_board(station_name):
+    if _boards_pending() and bus_network_file_exists():
+        # Saved by an earlier version, without boards, or not all merged.
+        buses = get_snapshot()['buses']
+        _mark_boards_pending()
+        _save_boards({}, buses)
+    try:
+        with open(_board_file(station_name), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+# The version of the bus network saved locally, as given by the server,
+# or None if not known.
+def get_bus_network_version():
+    try:
+        return get_snapshot().get('version')
+    except (IOError, OSError, ValueError):
+        return None
+
+# The whole bus network, put together from all the shards.
 def get_bus_network():
-    with open(_bus_network_file(), "r") as f:
+    snapshot = get_snapshot()
+    return {"update": snapshot['update'],
+            "buses": [json.loads(_read(bus['hash'])) for bus in snapshot['buses']]}
+
+# What the first screens need, much smaller and faster to load than the
+# whole bus network: the update string and the buses with the station
+# names of their routes, without the timetables (see get_bus).
+def get_snapshot():
+    if not os.path.exists(_manifest_file()) and os.path.exists(_old_bus_network_file()):
+        _upgrade()
+    with open(_manifest_file(), "r") as f:
         return json.load(f)
 
-# Save the json file in the same folder as the main application. 
+# The bus with the given name, timetables included, or None.
+# Only the shard of this bus is loaded.
+def get_bus(name):
+    for bus in get_snapshot()['buses']:
+        if bus['name'] == name:
+            return json.loads(_read(bus['hash']))
+    return None
+
+# Earlier versions kept the bus network in a single file.
+def _upgrade():
+    with open(_old_bus_network_file(), "r") as f:
+        save_bus_network(json.load(f))
+    os.remove(_old_bus_network_file())
+
+# The same bytes for the same bus, as the server hashes them (see
+# payload.dumps on the server), whatever the order of the dict keys.
+def _dumps(bus):
+    return json.dumps(bus, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+def _hash(shard):
+    return hashlib.sha256(shard).hexdigest()
+
+def _read(shard_hash):
+    with open(_shard_file(shard_hash), "rb") as f:
+        return f.read().decode('utf-8')
+
+# Write under a temporary name first, so that a file is either
+# complete or missing, even if the app is killed while saving.
+# os.replace would do, but is not there on Python 2. Only on Windows
+# does os.rename not replace an existing file.
+def _write(file_name, content):
+    temp = file_name + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(content)
+    if os.name == "nt" and os.path.exists(file_name):
+        os.remove(file_name)
+    os.rename(temp, file_name)
+
+# Save the files in the same folder as the main application.
 # There is also the possibility of using the kivy user_data_dir.
-# This would save the file on different locations depending on 
+# This would save the file on different locations depending on
 # the device the app is running. But the code is a little more
-# complicated, as the path is only available throught the main 
+# complicated, as the path is only available throught the main
 # app object.
-def _bus_network_file():
+def _manifest_file():
+    return "bus_network_manifest.json"
+
+def _shards_dir():
+    return "bus_network_shards"
+
+def _shard_file(shard_hash):
+    return os.path.join(_shards_dir(), shard_hash + ".json")
+
+def _boards_dir():
+    return "bus_network_boards"
+
+def _parts_dir():
+    return os.path.join(_boards_dir(), "parts")
+
+def _pending_file():
+    return os.path.join(_boards_dir(), "pending")
+
+def _part_file(shard_hash):
+    return os.path.join(_parts_dir(), shard_hash + ".json")
+
+# Station names may contain slashes, so the files are named after their hash.
+def _board_file(station_name):
+    return os.path.join(_boards_dir(), hashlib.sha1(station_name.encode('utf-8')).hexdigest() + ".json")
+
+def _old_bus_network_file():
     return "bus_network.json"
 
 def bus_network_file_exists():
-    return os.path.exists(_bus_network_file())
-
+    return os.path.exists(_manifest_file()) or os.path.exists(_old_bus_network_file())
@@ -1,28 +1,143 @@
-import sys
+import json
 import persistence
 import logging
-if sys.version_info.major == 3:
-    import urllib.request as request
-elif sys.version_info.major == 2:
-    import urllib2 as request
 from kivy.network.urlrequest import UrlRequest
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
 
 web_bus_network = "http://tsbserver.herokuapp.com/busnetwork"
 web_update_string = "http://tsbserver.herokuapp.com/update"
 
-def request_bus_network():
+web_bus_network_delta = "http://tsbserver.herokuapp.com/busnetwork/delta?since={}"
+web_bus_network_manifest = "http://tsbserver.herokuapp.com/busnetwork/manifest"
+web_bus = "http://tsbserver.herokuapp.com/buses/{}"
+
+# Seconds to wait for the server before giving up on a request.
+timeout = 20
+
+# The update string from the server, asked for once per session, and
+# the callbacks waiting for it while the request is on its way.
+_update_string = None
+_update_string_callbacks = []
+
+# Download the url in the background, without blocking the UI.
+# on_success(body, headers) gets the raw body and the response headers,
+# on_failure(message) is called for errors, timeouts included, and
+# on_progress(current, total) while downloading, total being -1 when
+# not known. All are called from the main thread.
+def fetch(url, on_success, on_failure=None, on_progress=None):
+    def success(req, result):
+        if req.resp_status is not None and req.resp_status >= 400:
+            failure(req, "HTTP {}".format(req.resp_status))
+            return
+        on_success(result, req.resp_headers or {})
+    def failure(req, error):
+        logging.info("tsbapp - {} failed: {}".format(url, error))
+        if on_failure:
+            on_failure(str(error))
+    def progress(req, current, total):
+        if on_progress:
+            on_progress(current, total)
+    return UrlRequest(url, on_success=success, on_failure=failure,
+                      on_error=failure, on_progress=progress,
+                      timeout=timeout, decode=False)
+
+# Only download the changes since the local version of the bus network,
+# if the server still knows about it. Otherwise only download the buses
+# that changed, as listed by the server manifest (see persistence). If
+# that does not work out either, download the whole bus network.
+# on_done(saved) is called once the bus network was saved, or not.
+# on_progress(current, total) counts the bytes of the changes or of the
+# whole bus network downloaded so far, or the buses.
+def request_bus_network(on_done=None, on_progress=None):
+    def done(saved):
+        if on_done:
+            on_done(saved)
+    def full(*args):
+        fetch(web_bus_network, saved_full, lambda message: done(False), on_progress)
+    def saved_full(body, headers):
+        _save(lambda: persistence.save_bus_network(body, _version(headers)), done)
+    def manifest_received(body, headers):
+        try:
+            manifest = json.loads(_text(body))
+        except ValueError:
+            full()
+            return
+        _request_shards(manifest, done, full, on_progress)
+    def shards(*args):
+        fetch(web_bus_network_manifest, manifest_received, full)
+    def saved_delta(body, headers):
+        _save(lambda: persistence.apply_bus_network_delta(body), done, shards)
+    version = persistence.get_bus_network_version()
+    if version:
+        fetch(web_bus_network_delta.format(version), saved_delta, shards, on_progress)
+    else:
+        shards()
+
+def _request_shards(manifest, done, on_failure, on_progress):
+    missing = persistence.missing_shards(manifest)
+    shards = {}
+    failed = []
+    def received(bus, body):
+        shards[bus['hash']] = body if isinstance(body, bytes) else body.encode('utf-8')
+        if on_progress:
+            on_progress(len(shards), len(missing))
+        if len(shards) == len(missing):
+            _save(lambda: persistence.save_shards(manifest, shards), done, on_failure)
+    def failure(message):
+        # Only fall back once, whatever the number of failed buses.
+        if not failed:
+            failed.append(message)
+            on_failure()
+    if not missing:
+        _save(lambda: persistence.save_shards(manifest, shards), done, on_failure)
+    for bus in missing:
+        fetch(web_bus.format(quote(bus['name'].encode('utf-8'), safe="")),
+              lambda body, headers, bus=bus: received(bus, body), failure)
+
+def _save(save, done, on_failure=None):
     try:
-        response = request.urlopen(web_bus_network)
-        persistence.save_bus_network(response.read())
+        save()
     except Exception as e:
         logging.error("tsbapp - {}".format(e))
+        if on_failure:
+            on_failure()
+        else:
+            done(False)
+        return
+    done(True)
 
-def request_update_string():
-    try:
-        response = request.urlopen(web_update_string)
-        response_str = response.read().decode('utf-8')
+def _text(body):
+    return body.decode('utf-8') if isinstance(body, bytes) else body
+
+# The server tags the bus network with its version.
+def _version(headers):
+    etag = headers.get("ETag")
+    if not etag:
+        return None
+    return etag.strip('"').split("-")[0]
+
+# Calls callback with the update string from the server, or "" if it
+# could not be retrieved. The server is only asked once per session.
+def request_update_string(callback):
+    if _update_string is not None:
+        callback(_update_string)
+        return
+    _update_string_callbacks.append(callback)
+    if len(_update_string_callbacks) > 1:
+        # Already on its way.
+        return
+    def success(body, headers):
+        global _update_string
         # Withot the replace, the string would look like '"update_string_sample"'
-        return response_str.replace("\"", "")
-    except Exception as e:
-        logging.error("tsbapp - {}".format(e))
-        return ""
+        _update_string = _text(body).replace("\"", "")
+        answer(_update_string)
+    def answer(update_string):
+        callbacks = list(_update_string_callbacks)
+        del _update_string_callbacks[:]
+        for waiting in callbacks:
+            waiting(update_string)
+    # Failures are not remembered, the next call tries again.
+    fetch(web_update_string, success, lambda message: answer(""))
@@ -12,43 +12,269 @@
 # be again given to the html downloader and the resulting pages given 
 # to the parser.
 
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import tsbparser as parser
 from utils import htmlget as htmlget
 #from tests.utils_mock import htmlget as htmlget
 
-def update():
+# Number of pages downloaded in parallel while building the bus network.
+fetch_workers = 8
+# Number of processes parsing the downloaded pages, as parsing is CPU
+# bound. Set to 0 to parse the pages in the downloading threads instead.
+parse_workers = os.cpu_count() or 1
+# Most pages downloaded and waiting to be parsed at any time, so that
+# memory use stays flat when downloading is faster than parsing.
+max_pending = 64
+
+def trasee():
+    """
+    The tursib.ro page listing all the buses.
+    """
+    return htmlget("trasee")
+
+def update(tursib_ro_trasee=None):
     """
     String containing the last tursib update info.
+    The already downloaded trasee page can be given, see trasee.
     """
-    tursib_ro_trasee = htmlget("trasee")
-    return parser.update_string(tursib_ro_trasee)
+    return parser.update_string(tursib_ro_trasee or trasee())
 
-def bus_network():
+def fingerprint(tursib_ro_trasee):
+    """
+    Hash of the parts of the trasee page the bus network is built from:
+    the update string and the list of buses. Changes to the rest of the
+    page, like the news, leave it as it is.
+    """
+    relevant = [update(tursib_ro_trasee)]
+    relevant += [[bus['number'], bus['name'], bus['link']] for bus in parser.buses_list(tursib_ro_trasee)]
+    return hashlib.sha1(json.dumps(relevant).encode()).hexdigest()
+
+def routes_changed(hashes, workers=None):
+    """
+    Whether any of the bus pages changed since the hashes were taken,
+    see rebuild. The pages are downloaded again, but not parsed.
+    """
+    links = list(hashes["routes"])
+    with ThreadPoolExecutor(max_workers=workers or fetch_workers) as fetch:
+        pages = fetch.map(_page, links)
+        return any(hashes["routes"][link] != page_hash for link, (page_hash, page) in zip(links, pages))
+
+def bus_network(workers=None, processes=None):
     """
     Build the list with all tursib info.
+    The bus pages are downloaded in parallel, after which all the station
+    pages of all the buses are downloaded at once, using at most `workers`
+    simultaneous downloads. The downloaded pages are parsed by `processes`
+    processes. The result is the same as downloading and parsing the pages
+    one after the other.
+    """
+    return rebuild(workers=workers, processes=processes)[0]
+
+def rebuild(previous=None, hashes=None, workers=None, processes=None,
+            tursib_ro_trasee=None, deep=False):
     """
-    tursib_ro_trasee = htmlget("trasee")
+    Build the list with all tursib info, reusing what did not change since
+    the previous network was built. The hashes are the ones returned
+    together with the previous network. Buses whose page did not change are
+    taken as they are from the previous network, without downloading their
+    stations, unless `deep` is set, as timetables can change without their
+    bus page changing. The station pages that did not change keep their
+    timetable without being parsed again.
+    The already downloaded trasee page can be given, see trasee.
+    Returns the network, the hashes of the pages it was built from and a
+    report with the number of pages fetched and parsed and the number of
+    buses and stations reused.
+    """
+    previous = previous or {"buses": []}
+    hashes = hashes or {"routes": {}, "stations": {}}
+    report = {"fetched": 0 if tursib_ro_trasee else 1, "parsed": 1, "reused": 0}
+    old_buses = {bus['name']: bus for bus in previous['buses']}
+    known = _known_timetables(old_buses, hashes)
+    tursib_ro_trasee = tursib_ro_trasee or trasee()
+    new_hashes = {"trasee": fingerprint(tursib_ro_trasee), "routes": {}, "stations": {}}
     buseslist = parser.buses_list(tursib_ro_trasee)
-    buses = []
-    for bus in buseslist:
-        tursib_ro_traseu_x = htmlget(bus['link'])
-        stations = parser.bus_stations(tursib_ro_traseu_x)
-        buses.append({"name": "{} - {}".format(bus['number'], bus['name']), 
-                      "droute": _get_direct_stations(stations), 
-                      "rroute": _get_reverse_stations(stations)})
-    return {"buses": buses,"update": update()}
-
-def _get_direct_stations(stations):
-    return _get_station_name_and_timetable(stations['directroutes'])
-
-def _get_reverse_stations(stations):
-    return _get_station_name_and_timetable(stations['reverseroutes'])
-
-def _get_station_name_and_timetable(station_name_link):
+    processes = parse_workers if processes is None else processes
+    with ThreadPoolExecutor(max_workers=workers or fetch_workers) as fetch, \
+         _parse_pool(processes) as parse:
+        stages = {"fetch": fetch, "parse": parse,
+                  "pending": threading.BoundedSemaphore(max_pending)}
+        pages = list(fetch.map(_page, [bus['link'] for bus in buseslist]))
+        report["fetched"] += len(pages)
+        all_stations = []
+        for bus, (page_hash, tursib_ro_traseu_x) in zip(buseslist, pages):
+            new_hashes["routes"][bus['link']] = page_hash
+            if not deep and hashes["routes"].get(bus['link']) == page_hash and _bus_name(bus) in old_buses:
+                all_stations.append(None)
+                continue
+            all_stations.append(parse.submit(parser.bus_stations, tursib_ro_traseu_x))
+            report["parsed"] += 1
+        # Schedule every station page before waiting on any of them.
+        routes = []
+        for stations in all_stations:
+            if stations is None:
+                routes.append(None)
+                continue
+            stations = stations.result()
+            routes.append((_get_direct_stations(stations, stages, known),
+                           _get_reverse_stations(stations, stages, known)))
+        buses = []
+        for bus, route in zip(buseslist, routes):
+            name = _bus_name(bus)
+            if route is None:
+                buses.append(old_buses[name])
+                _reuse_hashes(name, hashes, new_hashes)
+                report["reused"] += 1
+                continue
+            droute, rroute = route
+            buses.append({"name": name,
+                          "droute": _result(droute, (name, "droute"), new_hashes, report),
+                          "rroute": _result(rroute, (name, "rroute"), new_hashes, report)})
+    return {"buses": buses,"update": update(tursib_ro_trasee)}, new_hashes, report
+
+def _bus_name(bus):
+    return "{} - {}".format(bus['number'], bus['name'])
+
+def _page(link):
+    """
+    Download the page and hash its content.
+    """
+    page = htmlget(link)
+    content = page.encode() if isinstance(page, str) else page
+    return hashlib.sha1(content).hexdigest(), page
+
+def _known_timetables(old_buses, hashes):
+    """
+    Map the station links to the hash of the station page and the timetable
+    parsed from it, as found in the previous network.
+    """
+    result = {}
+    for link, (page_hash, name, direction, position) in hashes["stations"].items():
+        try:
+            result[link] = (page_hash, old_buses[name][direction][position]['timetable'])
+        except (KeyError, IndexError):
+            continue
+    return result
+
+def _reuse_hashes(name, hashes, new_hashes):
+    for link, station in hashes["stations"].items():
+        if station[1] == name:
+            new_hashes["stations"][link] = station
+
+def _get_direct_stations(stations, stages, known):
+    return _get_station_name_and_timetable(stations['directroutes'], stages, known)
+
+def _get_reverse_stations(stations, stages, known):
+    return _get_station_name_and_timetable(stations['reverseroutes'], stages, known)
+
+def _get_station_name_and_timetable(station_name_link, stages, known):
+    """
+    Start downloading the timetables for all the stations on a route.
+    The timetables are futures, see _result.
+    """
     result = []
     for station in station_name_link:
-        tursib_ro_traseu_statie = htmlget(station['link'])
-        timetable = parser.station_timetable(tursib_ro_traseu_statie)
+        timetable = stages["fetch"].submit(_station_timetable, station['link'],
+                                           known.get(station['link']), stages)
+        result.append({'name': station['name'], 'link': station['link'], 'timetable': timetable})
+    return result
+
+def _station_timetable(link, known, stages):
+    """
+    Download the station page and hand it over to the parsers, unless the
+    page did not change. `known` is the hash and timetable of the page
+    from the previous network, if any.
+    Returns the hash of the page, and either its known timetable or
+    the future of the timetable being parsed.
+    """
+    stages["pending"].acquire()
+    try:
+        page_hash, tursib_ro_traseu_statie = _page(link)
+        if known and known[0] == page_hash:
+            stages["pending"].release()
+            return page_hash, known[1], None
+        parsing = stages["parse"].submit(parser.station_timetable, tursib_ro_traseu_statie)
+    except:
+        stages["pending"].release()
+        raise
+    parsing.add_done_callback(lambda future: stages["pending"].release())
+    return page_hash, None, parsing
+
+def _parse_pool(processes):
+    """
+    The processes parsing the pages, or _Inline if there are none.
+    """
+    if not processes:
+        return _Inline()
+    return _Processes(processes)
+
+class _Processes(object):
+    """
+    The processes parsing the pages, with the submit of the executors in
+    concurrent.futures. The processes are started fresh rather than
+    forked, as the downloading threads and the refresh scheduler (see
+    refresh.py) may hold locks while forking, which would then stay
+    locked in the children forever. ProcessPoolExecutor only takes the
+    start method from Python 3.7 on, so a multiprocessing pool is used.
+    """
+    def __init__(self, processes):
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._pool = context.Pool(processes)
+
+    def submit(self, function, *args):
+        future = Future()
+        self._pool.apply_async(function, args, callback=future.set_result,
+                               error_callback=future.set_exception)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error, *args):
+        if error is None:
+            self._pool.close()
+        else:
+            self._pool.terminate()
+        self._pool.join()
+        return False
+
+class _Inline(object):
+    """
+    Stands in for the parsing processes, parsing right away instead.
+    """
+    def submit(self, function, *args):
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+def _result(route, bus_direction, hashes, report):
+    """
+    Wait for all the station timetables on the route to be downloaded
+    and parsed, keeping the order of the stations.
+    """
+    result = []
+    for position, station in enumerate(route):
+        page_hash, timetable, parsing = station['timetable'].result()
+        parsed = parsing is not None
+        if parsed:
+            timetable = parsing.result()
+        hashes["stations"][station['link']] = [page_hash, bus_direction[0], bus_direction[1], position]
+        report["fetched"] += 1
+        report["parsed" if parsed else "reused"] += 1
         result.append({'name': station['name'], 'timetable': timetable})
     return result
 
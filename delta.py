@@ -0,0 +1,57 @@
+# Differences between two versions of the bus network, so that clients
+# holding an older version only download what changed.
+#
+# A delta holds the update string of the new network and its buses, in
+# order. Buses that did not change are given by name only. The others
+# are given in full, except for the stations that did not change, which
+# are given by their position in the same route of the old bus.
+
+def diff(old, new):
+    """
+    Returns the delta from the old to the new bus network.
+    """
+    old_buses = {bus['name']: bus for bus in old['buses']}
+    new_names = set(bus['name'] for bus in new['buses'])
+    buses = []
+    for bus in new['buses']:
+        previous = old_buses.get(bus['name'])
+        if previous == bus:
+            buses.append(bus['name'])
+        elif previous is None:
+            buses.append(bus)
+        else:
+            buses.append({"name": bus['name'],
+                          "droute": _diff_route(previous['droute'], bus['droute']),
+                          "rroute": _diff_route(previous['rroute'], bus['rroute'])})
+    return {"update": new['update'],
+            "buses": buses,
+            "removed": [name for name in old_buses if name not in new_names]}
+
+def _diff_route(old, new):
+    positions = {}
+    for position, station in enumerate(old):
+        positions.setdefault(_key(station), position)
+    return [positions.get(_key(station), station) for station in new]
+
+def _key(station):
+    return station['name'], repr(station['timetable'])
+
+def apply(old, delta):
+    """
+    Returns the new bus network, given the old one and the delta to the new one.
+    """
+    old_buses = {bus['name']: bus for bus in old['buses']}
+    buses = []
+    for bus in delta['buses']:
+        if isinstance(bus, str):
+            buses.append(old_buses[bus])
+            continue
+        previous = old_buses.get(bus['name'], {"droute": [], "rroute": []})
+        buses.append({"name": bus['name'],
+                      "droute": _apply_route(previous['droute'], bus['droute']),
+                      "rroute": _apply_route(previous['rroute'], bus['rroute'])})
+    return {"update": delta['update'], "buses": buses}
+
+def _apply_route(old, route):
+    return [old[station] if isinstance(station, int) else station
+            for station in route]
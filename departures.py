@@ -0,0 +1,58 @@
+# Next departures from a station, across all the buses stopping there.
+# Works on the compact bus network (see model.py), whose departures are
+# sorted minutes since midnight, so finding the next one is a binary search.
+
+import bisect
+import index
+
+# The names of the timetables valid on weekdays, saturdays and sundays.
+# Most buses have one timetable for weekdays, one for saturdays and one
+# for sundays. Some have a single timetable for the whole week.
+weekdays = ("Luni - Vineri", "Luni - Duminica")
+saturdays = ("Sambata", "Luni - Duminica")
+sundays = ("Duminica", "Luni - Duminica")
+
+def day_types(date):
+    """
+    The names of the timetables valid on the given date.
+    """
+    weekday = date.weekday()
+    if weekday < 5:
+        return weekdays
+    if weekday == 5:
+        return saturdays
+    return sundays
+
+def build(network):
+    """
+    Map every normalized station name (see index.normalize) to the routes
+    stopping there, as (bus name, direction, model.Station) tuples.
+    """
+    stations = {}
+    for bus in network.buses:
+        for route in (bus.droute, bus.rroute):
+            for station in route.stations:
+                stations.setdefault(index.normalize(station.name), []).append(
+                    (bus.name, route.direction, station))
+    return stations
+
+def next_departures(stations, station_name, when, limit=5):
+    """
+    The first departures from the station, at or after `when` (a datetime)
+    and on the same day, for all the buses. Returns at most `limit`
+    (minute, bus name, direction) tuples, sorted by time.
+    `stations` is the map returned by build.
+    """
+    days = day_types(when)
+    minute = when.hour * 60 + when.minute
+    result = []
+    for bus, direction, station in stations.get(index.normalize(station_name), ()):
+        for timetable in station.timetables:
+            if timetable.day in days:
+                departures = timetable.departures
+                start = bisect.bisect_left(departures, minute)
+                for departure in departures[start:start + limit]:
+                    result.append((departure, bus, direction))
+                break
+    result.sort()
+    return result[:limit]
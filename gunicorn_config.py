@@ -0,0 +1,9 @@
+# gunicorn settings, see the Procfile.
+
+import refresh
+
+def post_fork(server, worker):
+    # Every worker checks for a newer bus network in the background, see
+    # refresh.py. Started here rather than when main is imported, so that
+    # the tests and tools importing main do not start a scheduler.
+    refresh.start()
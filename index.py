@@ -0,0 +1,59 @@
+# Lookup tables over the bus network, built once for every version of
+# the network, so that finding a bus or a station does not mean
+# walking through the whole network.
+
+import difflib
+import re
+import unicodedata
+
+def build(network):
+    """
+    Returns a dictionary with the buses by name ("buses") and, for every
+    (bus name, direction) pair, the stations on that route by name ("stations").
+    The direction is either "droute" or "rroute".
+    """
+    buses = {}
+    stations = {}
+    for bus in network['buses']:
+        buses.setdefault(bus['name'], bus)
+        for direction in ("droute", "rroute"):
+            route = stations[(bus['name'], direction)] = {}
+            for station in bus[direction]:
+                route.setdefault(station['name'], station)
+    return {"buses": buses, "stations": stations}
+
+def normalize(name):
+    """
+    The station name in upper case, without diacritics and with any
+    punctuation or run of spaces replaced by a single space, so that
+    "Piața  Unirii" and "PIATA UNIRII" are the same station.
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return re.sub(r"[\W_]+", " ", name).strip().upper()
+
+def stations(network):
+    """
+    Map the normalized name of every station to its name as found on
+    tursib.ro ("name") and to the routes stopping there ("stops"), as
+    [bus name, direction, position of the station on the route] lists.
+    """
+    result = {}
+    for bus in network['buses']:
+        for direction in ("droute", "rroute"):
+            for position, station in enumerate(bus[direction]):
+                entry = result.setdefault(normalize(station['name']),
+                                          {"name": station['name'], "stops": []})
+                entry["stops"].append([bus['name'], direction, position])
+    return result
+
+def find(stations, name, limit=5):
+    """
+    The normalized names of the stations matching the given name. The
+    station with the same normalized name if there is one, otherwise
+    at most `limit` stations with close names, best match first.
+    """
+    key = normalize(name)
+    if key in stations:
+        return [key]
+    return difflib.get_close_matches(key, list(stations), limit, 0.6)
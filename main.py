@@ -1,9 +1,19 @@
-import data
+import datetime
+import departures
+import index
+import model
+import payload
 import persistence
-from flask import Flask
+import planner
+import refresh
+import pytz
+from flask import Flask, Response, request
 from flask.ext import restful
 from flask import jsonify
 
+# Timetables are in local time.
+timezone = pytz.timezone("Europe/Bucharest")
+
 app = Flask(__name__)
 api = restful.Api(app)
 
@@ -13,7 +23,152 @@ class Update(restful.Resource):
 
 class BusNewtork(restful.Resource):
     def get(self):
-        return persistence.get_network()
+        return _send(persistence.get_network_payload())
+
+class Manifest(restful.Resource):
+    def get(self):
+        return _send(persistence.get_manifest())
+
+class RefreshStatus(restful.Resource):
+    def get(self):
+        return refresh.status()
+
+class BusNetworkDelta(restful.Resource):
+    def get(self):
+        prepared = persistence.get_network_delta(request.args.get('since', ''))
+        if prepared is None:
+            return {"message": "Unknown bus network version"}, 404
+        return _send(prepared)
+
+class Buses(restful.Resource):
+    def get(self):
+        return _send(persistence.get_prepared(("buses",), lambda:
+            [bus['name'] for bus in persistence.get_network()['buses']]))
+
+class Bus(restful.Resource):
+    def get(self, name):
+        return _send(persistence.get_prepared(("bus", name), lambda: _bus(name)))
+
+class RouteStations(restful.Resource):
+    def get(self, name, direction):
+        return _send(persistence.get_prepared(("stations", name, direction), lambda:
+            [station['name'] for station in _bus(name)[direction]]))
+
+class Timetable(restful.Resource):
+    def get(self, name, direction, station):
+        return _send(persistence.get_prepared(("timetable", name, direction, station), lambda:
+            _station(name, direction, station)['timetable']))
+
+class Departures(restful.Resource):
+    def get(self, station):
+        """
+        Next departures from the station, at or after ?when=YYYY-MM-DDTHH:MM
+        (now if not given), at most ?limit= of them.
+        """
+        when = _when()
+        try:
+            limit = int(request.args.get('limit', 5))
+        except ValueError as e:
+            restful.abort(400, message=str(e))
+        if limit < 1:
+            restful.abort(400, message="limit must be at least 1")
+        found = index.find(persistence.get_stations(), station, 1)
+        if not found:
+            restful.abort(404, message="Unknown station {}".format(station))
+        return [{"time": model.hour(minute), "bus": bus, "direction": direction}
+                for minute, bus, direction in
+                departures.next_departures(persistence.get_departures(), found[0], when, limit)]
+
+class Journey(restful.Resource):
+    def get(self):
+        """
+        The journey arriving the earliest from the ?from= station to the ?to=
+        station, leaving at or after ?when=YYYY-MM-DDTHH:MM (now if not given).
+        """
+        when = _when()
+        stations = persistence.get_stations()
+        ends = []
+        for name in (request.args.get('from', ''), request.args.get('to', '')):
+            found = index.find(stations, name, 1)
+            if not found:
+                restful.abort(404, message="Unknown station {}".format(name))
+            ends.append(found[0])
+        connections = persistence.get_connections(departures.day_types(when))
+        origin, destination = [connections["stop_ids"].get(end) for end in ends]
+        if origin is None or destination is None:
+            return []
+        legs = planner.journey(connections, origin, destination, when.hour * 60 + when.minute)
+        return [{"bus": connections["trips"][trip][0],
+                 "direction": connections["trips"][trip][1],
+                 "from": connections["stops"][start],
+                 "departure": model.hour(departure),
+                 "to": connections["stops"][end],
+                 "arrival": model.hour(arrival)}
+                for trip, start, departure, end, arrival in legs]
+
+class Stations(restful.Resource):
+    def get(self):
+        return _send(persistence.get_prepared(("stations",), lambda:
+            sorted(station["name"] for station in persistence.get_stations().values())))
+
+class Station(restful.Resource):
+    def get(self, name):
+        """
+        The routes stopping in the station with the given name, or in the
+        stations with close names if there is none, as a list of
+        {"name": station name, "stops": [[bus, direction, position], ...]}.
+        """
+        stations = persistence.get_stations()
+        found = index.find(stations, name)
+        if not found:
+            restful.abort(404, message="Unknown station {}".format(name))
+        return _send(persistence.get_prepared(("station",) + tuple(found), lambda:
+            [stations[key] for key in found]))
+
+def _when():
+    """
+    The ?when=YYYY-MM-DDTHH:MM argument, or now if not given, both in
+    local time (see timezone).
+    """
+    when = request.args.get('when')
+    if not when:
+        return datetime.datetime.now(timezone)
+    try:
+        return timezone.localize(datetime.datetime.strptime(when, "%Y-%m-%dT%H:%M"))
+    except ValueError as e:
+        restful.abort(400, message=str(e))
+
+def _bus(name):
+    bus = persistence.get_index()["buses"].get(name)
+    if bus is None:
+        restful.abort(404, message="Unknown bus {}".format(name))
+    return bus
+
+def _station(name, direction, station_name):
+    station = persistence.get_index()["stations"].get((_bus(name)['name'], direction), {}).get(station_name)
+    if station is None:
+        restful.abort(404, message="Unknown station {}".format(station_name))
+    return station
+
+def _send(prepared):
+    """
+    Send a prepared json payload (see payload.build), compressed if the
+    client accepts it, or 304 if the client already has it.
+    """
+    encodings = [encoding for encoding in ("br", "gzip") if encoding in prepared]
+    encoding = request.accept_encodings.best_match(encodings, default="identity")
+    etags = [payload.etag(prepared, e) for e in ["identity"] + encodings]
+    if any(request.if_none_match.contains(etag) for etag in etags):
+        response = Response(status=304)
+    else:
+        response = Response(prepared[encoding], mimetype="application/json")
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(payload.etag(prepared, encoding))
+    response.headers["Vary"] = "Accept-Encoding"
+    # Clients may keep the response, but must check it is still current.
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 @app.route('/')
 def home():
@@ -23,27 +178,30 @@ def home():
 def update_bus_network():
     """
     Get a newer version of bus info if available.
-    Run this periodically.
+    The bus network is refreshed in the background, see refresh.py, so
+    this returns right away. A full rebuild is asked for with ?full=1,
+    checking all the station pages for changes with ?deep=1
     """
-    # Download and save to local storage if a different version is available.
-    if _new_version_available():
-        network = data.bus_network()
-        persistence.save_network(network)      
-        return "bus network updated"
-    else:
-        return "everything is already up to date"
-
-def _new_version_available():
-    return _tursib_version() != _local_version()
-
-def _tursib_version():
-    return data.update()
-
-def _local_version():
-    return persistence.get_network_update()
+    refresh.request_refresh(full=bool(request.args.get('full')),
+                            deep=bool(request.args.get('deep')))
+    return "bus network refresh queued", 202
 
 api.add_resource(Update, '/update')
+api.add_resource(RefreshStatus, '/updatebusnetwork/status')
 api.add_resource(BusNewtork, '/busnetwork')
+api.add_resource(BusNetworkDelta, '/busnetwork/delta')
+api.add_resource(Manifest, '/busnetwork/manifest')
+# Bus and station names may contain slashes.
+api.add_resource(Buses, '/buses')
+api.add_resource(Bus, '/buses/<path:name>')
+api.add_resource(RouteStations, '/buses/<path:name>/<any(droute, rroute):direction>/stations')
+api.add_resource(Departures, '/departures/<path:station>')
+api.add_resource(Journey, '/journey')
+api.add_resource(Stations, '/stations')
+api.add_resource(Station, '/stations/<path:name>')
+api.add_resource(Timetable, '/buses/<path:name>/<any(droute, rroute):direction>/stations/<path:station>/timetable')
 
 if __name__ == '__main__':
+    # Under gunicorn the scheduler is started by gunicorn_config.py.
+    refresh.start()
     app.run(debug=True)
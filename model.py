@@ -0,0 +1,144 @@
+# Compact in memory representation of the bus network.
+#
+# The json bus network (see data.bus_network) stores every departure as
+# a "HH:MM" string, in lists nested inside dictionaries. Here departures
+# are minutes since midnight, kept sorted in arrays of unsigned shorts,
+# names are interned and all the objects have slots. Converting to and
+# from the json form is lossless: the few timetable entries that are not
+# departure times (notes like "La orele marcate cu") are kept apart,
+# together with their position.
+
+import re
+import sys
+from array import array
+
+_time = re.compile(r"^(\d\d):(\d\d)$")
+
+
+class Network(object):
+    __slots__ = ("update", "buses")
+
+    def __init__(self, update, buses):
+        self.update = update
+        self.buses = buses
+
+
+class Bus(object):
+    __slots__ = ("name", "droute", "rroute")
+
+    def __init__(self, name, droute, rroute):
+        self.name = name
+        self.droute = droute
+        self.rroute = rroute
+
+
+class Route(object):
+    # The direction is either "droute" or "rroute".
+    __slots__ = ("direction", "stations")
+
+    def __init__(self, direction, stations):
+        self.direction = direction
+        self.stations = stations
+
+
+class Station(object):
+    __slots__ = ("name", "timetables")
+
+    def __init__(self, name, timetables):
+        self.name = name
+        self.timetables = timetables
+
+
+class Timetable(object):
+    # The day is the timetable name, like "Luni - Vineri".
+    # The departures are sorted minutes since midnight. The notes are
+    # (position, text) pairs for the entries that are not times, and the
+    # order is None if the times were already sorted, otherwise the
+    # positions of the departures in their original order.
+    __slots__ = ("day", "departures", "notes", "order")
+
+    def __init__(self, day, departures, notes=(), order=None):
+        self.day = day
+        self.departures = departures
+        self.notes = notes
+        self.order = order
+
+
+def minutes(hour):
+    """
+    Minutes since midnight for a "HH:MM" string, or None if it is not a time.
+    """
+    match = _time.match(hour)
+    if not match:
+        return None
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+def hour(minute):
+    """
+    "HH:MM" string for the minutes since midnight.
+    """
+    return "{:02d}:{:02d}".format(minute // 60, minute % 60)
+
+def from_json(network):
+    """
+    Build the compact bus network from its json form.
+    """
+    # The same station and day names are used by many buses, and the
+    # same hours by many stations.
+    names = {}
+    def intern(name):
+        return names.setdefault(name, sys.intern(name))
+    minute = _Minutes().__getitem__
+    buses = []
+    for bus in network['buses']:
+        routes = [Route(direction, [_station(station, intern, minute) for station in bus[direction]])
+                  for direction in ("droute", "rroute")]
+        buses.append(Bus(intern(bus['name']), *routes))
+    return Network(network['update'], buses)
+
+class _Minutes(dict):
+    # Remembers the minutes for all the hours seen so far.
+    def __missing__(self, hour):
+        result = self[hour] = minutes(hour)
+        return result
+
+def _station(station, intern, minute):
+    timetables = []
+    for day, hours in station['timetable']:
+        departures = list(map(minute, hours))
+        notes = ()
+        if None in departures:
+            notes = tuple((position, intern(entry)) for position, entry in enumerate(hours)
+                          if departures[position] is None)
+            departures = [entry for entry in departures if entry is not None]
+        order = None
+        if departures != sorted(departures):
+            order = array('H', sorted(range(len(departures)), key=departures.__getitem__))
+            order = array('H', sorted(range(len(order)), key=order.__getitem__))
+            departures.sort()
+        timetables.append(Timetable(intern(day), array('H', departures), notes, order))
+    return Station(intern(station['name']), tuple(timetables))
+
+def to_json(network):
+    """
+    The json form of the compact bus network.
+    """
+    return {"update": network.update,
+            "buses": [{"name": bus.name,
+                       "droute": _route_json(bus.droute),
+                       "rroute": _route_json(bus.rroute)}
+                      for bus in network.buses]}
+
+def _route_json(route):
+    return [{"name": station.name,
+             "timetable": [[timetable.day, _hours(timetable)] for timetable in station.timetables]}
+            for station in route.stations]
+
+def _hours(timetable):
+    departures = timetable.departures
+    if timetable.order is not None:
+        departures = [departures[position] for position in timetable.order]
+    hours = [hour(minute) for minute in departures]
+    for position, note in timetable.notes:
+        hours.insert(position, note)
+    return hours
@@ -0,0 +1,54 @@
+# Responses that are built once and sent many times. The body is
+# compressed once for every content encoding supported and tagged
+# with a strong ETag derived from its content, so that clients which
+# already have it can be answered with 304 Not Modified.
+
+import gzip
+import hashlib
+import io
+import json
+try:
+    import brotli
+except ImportError:
+    # Optional, brotli compression is only offered when available.
+    brotli = None
+
+def build(body):
+    """
+    Returns the ETag of the body (without quotes) and the body itself
+    for each available content encoding, in a dictionary with the keys
+    "etag", "identity", "gzip" and, optionally, "br".
+    """
+    result = {"etag": digest(body),
+              "identity": body,
+              "gzip": _gzip(body)}
+    if brotli:
+        result["br"] = brotli.compress(body)
+    return result
+
+def dumps(content):
+    """
+    The json of the content, always the same bytes for the same content.
+    Dicts are not ordered before Python 3.7, so every server process
+    would otherwise send its own bytes, with its own ETag and hash.
+    """
+    return json.dumps(content, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+def digest(body):
+    return hashlib.sha256(body).hexdigest()
+
+def etag(payload, encoding):
+    """
+    Each encoding gets its own ETag, as their bodies differ.
+    """
+    if encoding == "identity":
+        return payload["etag"]
+    return "{}-{}".format(payload["etag"], encoding)
+
+def _gzip(body):
+    # No timestamp in the header, so that the compressed body, like its
+    # ETag, only depends on the content.
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(body)
+    return out.getvalue()
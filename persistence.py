@@ -1,23 +1,357 @@
+import contextlib
+import hashlib
 import os
+import re
 import json
+import shutil
+import threading
+import binnet
+import delta
+import departures
+import index
+import model
+import payload
+import planner
+
+# Number of bus network versions kept for computing deltas from them.
+history_size = 5
+
+# What was built so far from the bus network in local storage and its
+# update string, together with the key of the bus network file they
+# belong to. See _file_key.
+_network = (None, {})
+_update = (None, None)
 
 def get_network():
     """
     Return the bus network info from local storage.
+    The file is only loaded again after it changes, so all the callers
+    share the same dictionary and must not modify it.
+    """
+    loaded = _loaded()
+    if "network" not in loaded:
+        loaded["network"] = json.loads(loaded["json"].decode('utf-8'))
+    return loaded["network"]
+
+def get_network_payload():
+    """
+    Return the bus network json, ready to be sent. See payload.build.
+    """
+    loaded = _loaded()
+    if "payload" not in loaded:
+        loaded["payload"] = payload.build(loaded["json"])
+    return loaded["payload"]
+
+def get_index():
+    """
+    Return the lookup tables for the bus network, see index.build.
+    """
+    loaded = _loaded()
+    if "index" not in loaded:
+        loaded["index"] = index.build(get_network())
+    return loaded["index"]
+
+def get_model():
+    """
+    Return the compact form of the bus network, see model.from_json.
+    The binary form saved next to the bus network is memory mapped
+    instead, when it was saved for the current version (see binnet.py).
+    """
+    loaded = _loaded()
+    if "model" not in loaded:
+        loaded["model"] = _binary_network() or model.from_json(get_network())
+    return loaded["model"]
+
+def _binary_network():
+    try:
+        network = binnet.load(_path("bus_network.bin"))
+    except (OSError, ValueError):
+        return None
+    if network.version != get_network_version():
+        return None
+    return network
+
+def get_departures():
+    """
+    Return the routes stopping in every station, see departures.build.
+    """
+    loaded = _loaded()
+    if "departures" not in loaded:
+        loaded["departures"] = departures.build(get_model())
+    return loaded["departures"]
+
+def get_connections(days):
+    """
+    Return the connections valid on the days using the given timetables,
+    see planner.build.
+    """
+    connections = _loaded().setdefault("connections", {})
+    if days not in connections:
+        connections[days] = planner.build(get_model(), days)
+    return connections[days]
+
+def get_prepared(key, content):
+    """
+    Return the json of content() ready to be sent, see payload.build.
+    It is only built the first time the key is used with the current
+    bus network.
+    """
+    prepared = _loaded().setdefault("prepared", {})
+    if key not in prepared:
+        prepared[key] = payload.build(payload.dumps(content()))
+    return prepared[key]
+
+def get_manifest():
+    """
+    Return the update string, the version and the buses of the bus network,
+    as their name and the hash of their json as sent from /buses/<name>
+    (also its ETag), ready to be sent. Clients keep every bus apart and
+    only download the ones whose hash changed.
+    """
+    network = get_network()
+    return get_prepared(("manifest",), lambda: {
+        "update": network['update'],
+        "version": get_network_version(),
+        "buses": [{"name": bus['name'], "hash": payload.digest(payload.dumps(bus))}
+                  for bus in network['buses']]})
+
+def get_network_version():
+    """
+    The version of the bus network is the hash of its json.
+    """
+    loaded = _loaded()
+    if "version" not in loaded:
+        loaded["version"] = payload.digest(loaded["json"])
+    return loaded["version"]
+
+def get_stations():
+    """
+    Return the routes stopping in every station, see index.stations.
+    These are saved next to the bus network, so they are only built
+    when missing or saved for another version of the network.
+    """
+    loaded = _loaded()
+    if "stations" not in loaded:
+        version = get_network_version()
+        try:
+            with open(_path("bus_network_stations.json"), 'r') as f:
+                saved = json.load(f)
+            if saved["version"] != version:
+                raise ValueError("saved for another bus network")
+            loaded["stations"] = saved["stations"]
+        except (OSError, ValueError, KeyError):
+            loaded["stations"] = index.stations(get_network())
+            _save_stations(loaded["stations"], version)
+    return loaded["stations"]
+
+def _save_stations(stations, version):
+    try:
+        with _atomic(_path("bus_network_stations.json")) as f:
+            json.dump({"version": version, "stations": stations}, f)
+    except OSError:
+        pass
+
+def get_network_delta(since):
+    """
+    Return the delta from the given version of the bus network to the
+    current one, ready to be sent (see delta.diff and payload.build), or
+    None if the given version is no longer available.
+    """
+    loaded = _loaded()
+    deltas = loaded.setdefault("deltas", {})
+    if since not in deltas:
+        current = get_network_version()
+        old = get_network() if since == current else _old_network(since)
+        if old is None:
+            return None
+        changes = delta.diff(old, get_network())
+        changes.update({"from": since, "to": current})
+        deltas[since] = payload.build(payload.dumps(changes))
+    return deltas[since]
+
+def _old_network(version):
+    if not re.match("^[0-9a-f]{64}$", version):
+        return None
+    try:
+        with open(os.path.join(_path("history"), version + ".json"), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _loaded():
+    """
+    Everything built from the current bus network file. Starts over
+    with the file content whenever the file changes.
     """
-    path = os.path.dirname(__file__)
-    path = os.path.join(path, "bus_network.json")
-    json_file = open(path, 'r')
-    return json.loads(json_file.read())
+    global _network
+    path = _path("bus_network.json")
+    key = _file_key(path)
+    if _network[0] != key:
+        with open(path, 'rb') as json_file:
+            _network = (key, {"json": json_file.read()})
+    return _network[1]
 
 def get_network_update():
-    return get_network()['update']
+    """
+    Return the update string of the bus network from local storage.
+    The string is also saved in a small file next to the bus network,
+    so it is available without loading the whole network.
+    """
+    global _update
+    key = _file_key(_path("bus_network.json"))
+    if _update[0] != key:
+        _update = (key, _read_update(key))
+    return _update[1]
+
+def _read_update(key):
+    try:
+        with open(_path("bus_network_update.json"), 'r') as f:
+            update = json.load(f)
+        if update['network'] == list(key):
+            return update['update']
+    except (OSError, ValueError, KeyError):
+        pass
+    # Missing or saved for another bus network.
+    update = get_network()['update']
+    _save_update(update)
+    return update
+
+def _save_update(update):
+    """
+    Save the update string together with the key of the bus network file it belongs to.
+    """
+    try:
+        key = _file_key(_path("bus_network.json"))
+        with _atomic(_path("bus_network_update.json")) as f:
+            json.dump({"update": update, "network": list(key)}, f)
+    except OSError:
+        pass
+
+def _file_key(path):
+    """
+    Changes whenever the file is modified or replaced.
+    """
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
 
 def save_network(bus_network_info):
     """
     Saves a copy of the bus network info to local storage for later retrieval.
+    The json is streamed to a temporary file which then replaces the bus
+    network file, so readers always see either the old or the new network.
+    """
+    path = _path("bus_network.json")
+    # Keep the version being replaced, for deltas from it.
+    if os.path.exists(path):
+        _save_history(path, _file_digest(path))
+    with _atomic(path, 'wb') as f:
+        hashing = _Hashing(f)
+        json.dump(bus_network_info, hashing)
+    _save_update(bus_network_info['update'])
+    _save_stations(index.stations(bus_network_info), hashing.version())
+    _save_binary(bus_network_info, hashing.version())
+    _save_history(path, hashing.version())
+
+def _save_binary(bus_network_info, version):
+    try:
+        with _atomic(_path("bus_network.bin"), 'wb') as f:
+            f.write(binnet.dumps(model.from_json(bus_network_info), version))
+    except OSError:
+        pass
+
+class _Hashing(object):
+    """
+    Writes the json text to a binary file, hashing it on the way.
+    The hash is the version of the network, see payload.digest.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.sha256()
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.hash.update(data)
+        self.f.write(data)
+
+    def version(self):
+        return self.hash.hexdigest()
+
+def _file_digest(path):
+    # Same as payload.digest, without reading the whole file at once.
+    result = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            result.update(chunk)
+    return result.hexdigest()
+
+def _save_history(path, version):
+    """
+    Keep a copy of the bus network file under its version, dropping the
+    oldest copies so that at most history_size are kept.
+    """
+    history = _path("history")
+    os.makedirs(history, exist_ok=True)
+    with open(path, 'rb') as source, _atomic(os.path.join(history, version + ".json"), 'wb') as f:
+        shutil.copyfileobj(source, f)
+    copies = [os.path.join(history, name) for name in os.listdir(history) if name.endswith(".json")]
+    copies.sort(key=os.path.getmtime, reverse=True)
+    for copy in copies[history_size:]:
+        os.remove(copy)
+
+@contextlib.contextmanager
+def _atomic(path, mode='w'):
+    """
+    Open a temporary file next to the given one for writing. Once written
+    and synced to disk it replaces the file in one step, unless writing
+    failed, in which case the file is left as it was.
+    """
+    temp = "{}.{}.{}".format(path, os.getpid(), threading.get_ident())
+    try:
+        with open(temp, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp)
+        raise
+
+def get_hashes():
+    """
+    Return the hashes of the pages the local bus network was built from,
+    or None if these are not available.
     """
-    bus_network_json = json.dumps(bus_network_info)
-    with open("bus_network.json", 'w') as f:
-        f.write(bus_network_json)
+    try:
+        with open(_path("bus_network_hashes.json"), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
+def save_hashes(hashes):
+    """
+    Saves the hashes of the pages the bus network was built from, see data.rebuild.
+    """
+    with _atomic(_path("bus_network_hashes.json")) as f:
+        json.dump(hashes, f)
+
+def get_refresh_status():
+    """
+    Return the state of the bus network refreshes, see refresh.status,
+    or an empty dictionary if there were none yet.
+    """
+    try:
+        with open(_path("bus_network_refresh.json"), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_refresh_status(status):
+    with _atomic(_path("bus_network_refresh.json")) as f:
+        json.dump(status, f)
+
+def _path(file_name):
+    """
+    Files are stored next to this module.
+    """
+    return os.path.join(os.path.dirname(__file__), file_name)
@@ -0,0 +1,108 @@
+# Journey planning over the bus network, with the Connection Scan
+# Algorithm (Dibbelt et al., "Intriguingly Simple and Fast Transit
+# Routing").
+#
+# Every bus going from one station to the next one on its route is a
+# connection. The connections valid on a given day are kept in flat
+# arrays sorted by departure time, and the earliest arrival from one
+# station to another is found by scanning these arrays once.
+#
+# The connections of a trip are the hops between its consecutive
+# stations, see trips.py.
+#
+# Stations are identified by their normalized name (see index.normalize),
+# so buses stopping in stations with the same name can be changed.
+
+import bisect
+from array import array
+import index
+import trips as trips_table
+
+# Time, in minutes, needed to change buses.
+transfer = 2
+
+def build(network, days):
+    """
+    The connections of the compact bus network (see model.py) valid on
+    the days using the given timetables (see departures.day_types).
+    Returns a dictionary with the station names ("stops"), the stop
+    index of every normalized station name ("stop_ids"), the bus name
+    and direction of every trip ("trips") and the connection arrays,
+    sorted by departure: "departure", "arrival" (minutes since midnight),
+    "start", "end" (stop indexes) and "trip" (trip index).
+    """
+    stops = []
+    stop_ids = {}
+    routes = {}
+    for bus in network.buses:
+        for route in (bus.droute, bus.rroute):
+            ids = routes[(bus.name, route.direction)] = []
+            for station in route.stations:
+                key = index.normalize(station.name)
+                if key not in stop_ids:
+                    stop_ids[key] = len(stops)
+                    stops.append(station.name)
+                ids.append(stop_ids[key])
+    table = trips_table.build(network, days)
+    connections = []
+    for trip, ((bus, direction, first), times) in enumerate(zip(table["trips"], table["times"])):
+        ids = routes[(bus, direction)][first:]
+        for hop in range(len(times) - 1):
+            connections.append((times[hop], times[hop + 1], ids[hop], ids[hop + 1], trip))
+    # Stable, so the connections of a trip in the same minute stay in order.
+    connections.sort(key=lambda connection: connection[:2])
+    return {"stops": stops,
+            "stop_ids": stop_ids,
+            "trips": [(bus, direction) for bus, direction, first in table["trips"]],
+            "departure": array('H', [c[0] for c in connections]),
+            "arrival": array('H', [c[1] for c in connections]),
+            "start": array('I', [c[2] for c in connections]),
+            "end": array('I', [c[3] for c in connections]),
+            "trip": array('I', [c[4] for c in connections])}
+
+def journey(connections, origin, destination, minute):
+    """
+    The journey arriving the earliest from the origin to the destination
+    stop (indexes in connections["stops"]), leaving at or after the given
+    minute. Returns the legs of the journey, as (trip, stop, minute
+    leaving that stop, stop, minute arriving there) tuples, or an empty
+    list if the destination can not be reached on the same day.
+    """
+    stops = len(connections["stops"])
+    departure = connections["departure"]
+    arrival = connections["arrival"]
+    start = connections["start"]
+    end = connections["end"]
+    trip = connections["trip"]
+    never = 0xffff
+    # Earliest arrival in every stop, and the first and last connection
+    # of the trip taken to get there.
+    earliest = [never] * stops
+    earliest[origin] = minute
+    legs = [None] * stops
+    # First connection taken on every trip reached so far.
+    boarded = {}
+    first = bisect.bisect_left(departure, minute)
+    for c in range(first, len(departure)):
+        if earliest[destination] <= departure[c]:
+            break
+        if trip[c] not in boarded:
+            ready = earliest[start[c]]
+            if start[c] != origin:
+                ready += transfer
+            if ready > departure[c]:
+                continue
+            boarded[trip[c]] = c
+        if arrival[c] < earliest[end[c]]:
+            earliest[end[c]] = arrival[c]
+            legs[end[c]] = (boarded[trip[c]], c)
+    if earliest[destination] == never or origin == destination:
+        return []
+    result = []
+    stop = destination
+    while stop != origin:
+        enter, leave = legs[stop]
+        result.append((trip[enter], start[enter], departure[enter], end[leave], arrival[leave]))
+        stop = start[enter]
+    result.reverse()
+    return result
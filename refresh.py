@@ -0,0 +1,197 @@
+# Refreshing the bus network in the background.
+#
+# Rebuilding the bus network takes minutes, far longer than a request
+# should. Instead, every server process runs a scheduler thread which
+# checks tursib.ro for a newer bus network every `interval` seconds, plus
+# a random jitter so that the checks of several servers are spread out.
+# A lock file makes sure only one process rebuilds the network at a time,
+# and the state of the refreshes is kept in a status file next to the bus
+# network, so all the processes can report it.
+
+import fcntl
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+import data
+import departures
+import model
+import persistence
+import trips
+
+# Seconds between two checks for a newer bus network, set to 0 to only
+# refresh on request. Up to `jitter` more seconds are waited every time.
+interval = int(os.environ.get("TSB_REFRESH_INTERVAL", 6 * 3600))
+jitter = int(os.environ.get("TSB_REFRESH_JITTER", 600))
+# Every that many scheduled refreshes one is deep: all the station pages
+# are checked, see data.rebuild. Set to 0 to never do a deep refresh.
+deep_every = int(os.environ.get("TSB_DEEP_REFRESH_EVERY", 4))
+
+logger = logging.getLogger(__name__)
+
+_lock_file = os.path.join(os.path.dirname(__file__), "refresh.lock")
+# Held as well for as long as a refresh runs, so that status can tell
+# without taking the lock above, which would make a scheduled refresh
+# starting at the same time skip its run.
+_running_file = os.path.join(os.path.dirname(__file__), "refresh.running")
+# Wakes the scheduler up for a refresh asked for with request_refresh.
+_wake = threading.Event()
+_queued = {"full": False, "deep": False}
+_queued_lock = threading.Lock()
+_scheduler = None
+
+def start():
+    """
+    Start the scheduler thread of this process, if not already started.
+    Called for every gunicorn worker, see gunicorn_config.py.
+    """
+    global _scheduler
+    with _queued_lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_schedule, name="refresh", daemon=True)
+            _scheduler.start()
+
+def request_refresh(full=False, deep=False):
+    """
+    Have the scheduler refresh the bus network as soon as possible, rather
+    than at its next check. Returns right away.
+    """
+    with _queued_lock:
+        _queued["full"] = _queued["full"] or full
+        _queued["deep"] = _queued["deep"] or deep
+    start()
+    _wake.set()
+
+def _schedule():
+    rounds = 0
+    while True:
+        asked = _wake.wait(interval + random.uniform(0, jitter) if interval else None)
+        _wake.clear()
+        with _queued_lock:
+            full, _queued["full"] = _queued["full"], False
+            deep, _queued["deep"] = _queued["deep"], False
+        if not asked:
+            rounds += 1
+            deep = deep_every > 0 and rounds % deep_every == 0
+        try:
+            # Asked for refreshes wait for a running one, scheduled ones
+            # are skipped, as another process is already at it.
+            refresh(full, deep, wait=asked)
+        except Exception:
+            logger.exception("bus network refresh failed")
+
+def refresh(full=False, deep=False, wait=False):
+    """
+    Rebuild and save the bus network if tursib.ro has a newer one.
+    Only the buses whose page changed on tursib.ro are downloaded again,
+    unless `full` is set, or their stations changed, when `deep` is set.
+    Returns a message with the outcome, or None if another process is
+    refreshing and `wait` is not set.
+    """
+    with open(_lock_file, 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return None
+        with open(_running_file, 'a') as running:
+            # Only ever held for a moment by status.
+            fcntl.flock(running, fcntl.LOCK_EX)
+            return _refresh(full, deep)
+
+def _refresh(full, deep):
+    started = time.time()
+    _save_status(running=True, started=_timestamp(started))
+    try:
+        result = _update(full, deep)
+    except Exception as e:
+        _save_status(running=False, last_error={
+            "at": _timestamp(time.time()),
+            "duration": round(time.time() - started, 3),
+            "error": "".join(traceback.format_exception_only(type(e), e)).strip()})
+        raise
+    _save_status(running=False, last_success={
+        "at": _timestamp(time.time()),
+        "duration": round(time.time() - started, 3),
+        "result": result})
+    logger.info(result)
+    return result
+
+def _update(full, deep):
+    # Download and save to local storage if a different version is available.
+    tursib_ro_trasee = data.trasee()
+    previous, hashes = None, None
+    if not full:
+        previous, hashes = persistence.get_network(), persistence.get_hashes()
+        if not deep and _unchanged(tursib_ro_trasee, hashes):
+            return "everything is already up to date"
+    network, hashes, report = data.rebuild(previous, hashes, tursib_ro_trasee=tursib_ro_trasee, deep=deep)
+    # The hashes describe the pages the saved network was built from, so
+    # they are only saved once the network is.
+    if network == previous:
+        persistence.save_hashes(hashes)
+        return ("no changes found: {fetched} pages fetched, {parsed} parsed, "
+                "{reused} entries reused".format(**report))
+    persistence.save_network(network)
+    persistence.save_hashes(hashes)
+    _log_trip_anomalies()
+    return ("bus network updated: {fetched} pages fetched, {parsed} parsed, "
+            "{reused} entries reused".format(**report))
+
+def _unchanged(tursib_ro_trasee, hashes):
+    """
+    Cheap check for changes: the relevant part of the trasee page and the
+    bus pages, see data.fingerprint. Requests for pages still in the
+    download cache are conditional, see utils.htmlget.
+    """
+    if hashes is None:
+        # Nothing to compare the pages with, only the update string tells.
+        return data.update(tursib_ro_trasee) == persistence.get_network_update()
+    return (hashes.get("trasee") == data.fingerprint(tursib_ro_trasee)
+            and not data.routes_changed(hashes))
+
+def _log_trip_anomalies():
+    """
+    Departures from consecutive stations that could not be aligned into
+    trips, see trips.py. Worth a look after every update.
+    """
+    network = persistence.get_model()
+    for days in (departures.weekdays, departures.saturdays, departures.sundays):
+        anomalies = trips.build(network, days)["anomalies"]
+        logger.info("{}: {} trip anomalies".format(days[0], len(anomalies)))
+        for bus, direction, position, minute, kind in anomalies:
+            logger.debug("{} {} station {}: trip at {} {}".format(
+                bus, direction, position, model.hour(minute), kind))
+
+def status():
+    """
+    The state of the refreshes: whether one is running now ("running"),
+    when it started ("started"), how the last successful and the last
+    failed ones went ("last_success", "last_error") and the refresh
+    settings ("interval", "jitter", "deep_every").
+    """
+    result = persistence.get_refresh_status()
+    # The status file says running after a crash, the lock knows better.
+    result["running"] = _locked()
+    result.update({"interval": interval, "jitter": jitter, "deep_every": deep_every})
+    return result
+
+def _locked():
+    # Shared, so that several status polls do not get in each other's way.
+    with open(_running_file, 'a') as running:
+        try:
+            fcntl.flock(running, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(running, fcntl.LOCK_UN)
+        return False
+
+def _save_status(**changes):
+    # Only called while holding the lock, so no other process writes it.
+    current = persistence.get_refresh_status()
+    current.update(changes)
+    persistence.save_refresh_status(current)
+
+def _timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
@@ -0,0 +1,312 @@
+# Benchmarks, run from the repository root with:
+#   python -m tests.bench [--output results.json] [--compare old.json]
+#
+# Everything runs offline, on the pages in tests/samples and the bundled
+# bus_network.json. The results are a flat map from the benchmark name to
+# milliseconds (less is better) or requests per second ("/rps", more is
+# better), saved as json so the results of two commits can be compared.
+# Benchmarks whose dependencies are missing (Flask, Kivy) are listed as
+# skipped, with the reason.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tsbparser
+
+# Path to the html local samples taken from tursib.ro
+samples = os.path.join(os.path.dirname('__file__'), 'tests/samples')
+# The bus network bundled with the server.
+network_path = os.path.join(os.path.dirname('__file__'), 'bus_network.json')
+
+# The parser function for every sample page.
+pages = [("tursib_ro_trasee.htm", tsbparser.update_string),
+         ("tursib_ro_trasee.htm", tsbparser.buses_list),
+         ("tursib_ro_traseu_11.htm", tsbparser.bus_stations),
+         ("tursib_ro_traseu_11_Conti.htm", tsbparser.station_timetable),
+         ("tursib_ro_traseu_112_Bosch.htm", tsbparser.station_timetable)]
+
+# Exit code of the client benchmark process when the client dependencies
+# (Kivy) are missing, see client_bench.
+_missing_client = 3
+
+# Seconds added to every mocked download in network_bench.
+latencies = (0, 0.02)
+
+def _fileread(name):
+    with open(os.path.join(samples, name), "r", encoding='utf-8', errors='ignore') as f:
+        return f.read()
+
+def _time(function, number, repeat=3):
+    """
+    Best of `repeat` runs, in milliseconds per call.
+    """
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1000
+
+def parser_bench(number=20):
+    """
+    Milliseconds needed to parse every sample page, building the whole
+    tree and only the parts needed (see tsbparser.fast).
+    """
+    result = []
+    for name, function in pages:
+        html = _fileread(name)
+        times = {}
+        for fast in (False, True):
+            tsbparser.fast = fast
+            times["fast" if fast else "full"] = _time(lambda: function(html), number)
+        tsbparser.fast = True
+        result.append({"page": name, "function": function.__name__,
+                       "features": tsbparser.features, "ms": times})
+    return result
+
+def network_bench(latencies=latencies):
+    """
+    Milliseconds needed by data.bus_network on the sample pages, with
+    every download taking the given extra seconds. The download cache
+    and rate limit are not involved, as htmlget is mocked.
+    """
+    import data
+    import tests.utils_mock as utils_mock
+    result = {}
+    htmlget = data.htmlget
+    try:
+        for latency in latencies:
+            def slow_htmlget(address, latency=latency):
+                time.sleep(latency)
+                return utils_mock.htmlget(address)
+            data.htmlget = slow_htmlget
+            result["bus_network/latency {}ms".format(int(latency * 1000))] = _time(
+                data.bus_network, number=1, repeat=1)
+    finally:
+        data.htmlget = htmlget
+    return result
+
+def persistence_bench(number=10):
+    """
+    Milliseconds needed to load the bus network from local storage, both
+    the json (persistence.get_network) and the compact model
+    (persistence.get_model, memory mapped from the binary form), when
+    the file changed and when already loaded.
+    """
+    import persistence
+    with open(network_path, 'r') as f:
+        network = json.load(f)
+    storage = tempfile.mkdtemp()
+    path = persistence._path
+    persistence._path = lambda file_name: os.path.join(storage, file_name)
+    try:
+        persistence.save_network(network)
+        def cold(function):
+            # As if the file just changed.
+            persistence._network = (None, {})
+            return function()
+        return {"get_network/cold": _time(lambda: cold(persistence.get_network), number),
+                "get_network/warm": _time(persistence.get_network, number * 100),
+                "get_model/cold": _time(lambda: cold(persistence.get_model), number),
+                "get_network_payload/cold": _time(lambda: cold(persistence.get_network_payload), number)}
+    finally:
+        persistence._path = path
+        persistence._network = (None, {})
+        shutil.rmtree(storage)
+
+def trips_bench(number=3):
+    """
+    Milliseconds needed to rebuild the trips of the bundled bus network
+    (see trips.build), for every kind of day.
+    """
+    import departures
+    import model
+    import trips
+    with open(network_path, 'r') as f:
+        network = model.from_json(json.load(f))
+    return dict(("build/" + days[0], _time(lambda: trips.build(network, days), number))
+                for days in (departures.weekdays, departures.saturdays, departures.sundays))
+
+def server_bench(number=200):
+    """
+    Requests per second served by /busnetwork and /update, through the
+    Flask test client.
+    """
+    import main
+    client = main.app.test_client()
+    result = {}
+    for url, headers in (("/busnetwork", {}),
+                         ("/busnetwork", {"Accept-Encoding": "gzip"}),
+                         ("/update", {})):
+        client.get(url, headers=headers)
+        name = url + (" gzip" if headers else "")
+        result[name + "/rps"] = 1000 / _time(lambda: client.get(url, headers=headers), number)
+    return result
+
+def client_bench(number=1000):
+    """
+    Milliseconds needed by the lookups of client/data, on the bundled bus
+    network. Runs in its own process, as the client modules have the same
+    names as the server ones.
+    """
+    process = subprocess.Popen([sys.executable, "-m", "tests.bench", "--client-only", str(number)],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    err = err.decode('utf-8').strip()
+    if process.returncode == _missing_client:
+        raise ImportError(err.splitlines()[-1])
+    if process.returncode:
+        # Anything else is a failure of the benchmark, not to be skipped.
+        raise RuntimeError("client benchmark failed:\n" + err)
+    return json.loads(out.decode('utf-8'))
+
+def _client_lookups(number):
+    client = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "client")
+    sys.path.insert(0, client)
+    import datetime
+    import data
+    import persistence
+    with open(network_path, 'r') as f:
+        network = json.load(f)
+    # The client keeps its files in the working directory.
+    os.chdir(tempfile.mkdtemp())
+    persistence.save_bus_network(network)
+    def load():
+        data._forget_bus_network()
+        data._bus_network = persistence.get_bus_network()
+        data._build_indexes()
+    def snapshot():
+        data._forget_bus_network()
+        data.bus_names()
+    bus = network['buses'][3]
+    station = bus['rroute'][5]['name']
+    when = datetime.datetime(2015, 4, 1, 7, 0)
+    def cold_next_departures():
+        data._forget_bus_network()
+        data.next_departures(station, when)
+    result = {"startup/full": _time(load, 10),
+              "startup/snapshot": _time(snapshot, 10),
+              "startup/first screen/full": _first_screen_time(client, "full"),
+              "startup/first screen/snapshot": _first_screen_time(client, "snapshot"),
+              "next_departures/cold": _time(cold_next_departures, 10)}
+    data.next_departures(station, when)
+    result.update({"bus_names": _time(data.bus_names, number),
+                   "droute_names": _time(lambda: data.droute_names(bus['name']), number),
+                   "timetable": _time(lambda: data.timetable(bus['name'], station, "rroute"), number),
+                   "formated_timetable": _time(lambda: data.formated_timetable(bus['name'], station, "rroute"), number),
+                   "next_departures": _time(lambda: data.next_departures(station, when), number)})
+    # Every timetable of the bus network, through the indexes of client/data
+    # and scanning the bus and station lists as it was done before them.
+    data.bus_network()
+    stops = [(bus['name'], stop['name'], direction) for bus in network['buses']
+             for direction in ("droute", "rroute") for stop in bus[direction]]
+    def every(lookup):
+        for bus_name, station_name, direction in stops:
+            lookup(bus_name, station_name, direction)
+    result.update({"timetable/every station/index": _time(lambda: every(data.timetable), 10),
+                   "timetable/every station/scan": _time(
+                       lambda: every(lambda *stop: _scan_timetable(network, *stop)), 10)})
+    return result
+
+# What TsbApp.build asks client/data for before the first screen is
+# shown, in a fresh process, from the snapshot or, as before it, from the
+# whole bus network. Prints the milliseconds it took, imports included.
+_first_screen = """
+import sys
+import time
+started = time.perf_counter()
+sys.path.insert(0, {client!r})
+import data
+data.bus_network_exists()
+{bus_names}
+data.update_string_local()
+print((time.perf_counter() - started) * 1000)
+"""
+_bus_names = {"snapshot": "data.bus_names()",
+              "full": "[bus['name'] for bus in data.bus_network()['buses']]"}
+
+def _first_screen_time(client, source, repeat=5):
+    code = _first_screen.format(client=client, bus_names=_bus_names[source])
+    return min(float(subprocess.check_output([sys.executable, "-c", code]))
+               for _ in range(repeat))
+
+def _scan_timetable(network, bus_name, station_name, direction):
+    for bus in network['buses']:
+        if bus['name'] == bus_name:
+            for station in bus[direction]:
+                if station['name'] == station_name:
+                    return station['timetable']
+    return []
+
+def run():
+    """
+    Run all the benchmarks. Returns the results and the reasons the
+    skipped benchmarks were skipped.
+    """
+    results = {}
+    skipped = {}
+    for entry in parser_bench():
+        for mode, ms in entry["ms"].items():
+            results["parse/{function}/{page}/{mode}".format(mode=mode, **entry)] = ms
+    for group, bench in (("network", network_bench), ("persistence", persistence_bench),
+                         ("trips", trips_bench), ("server", server_bench), ("client", client_bench)):
+        try:
+            for name, value in bench().items():
+                results[group + "/" + name] = value
+        except ImportError as e:
+            skipped[group] = str(e)
+    return results, skipped
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old, new):
+    """
+    Print the results side by side, with the change in percent. For
+    requests per second more is better, less for everything else.
+    """
+    for name in sorted(set(old["results"]) | set(new["results"])):
+        before, after = old["results"].get(name), new["results"].get(name)
+        change = ""
+        if before and after:
+            change = "{:+.0f}%".format((after / before - 1) * 100)
+        print("{:70} {:>10} {:>10} {:>6}".format(name, _format(before), _format(after), change))
+
+def _format(value):
+    return "-" if value is None else "{:.3f}".format(value)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks, see tests/bench.py")
+    parser.add_argument("--output", help="save the results to this json file")
+    parser.add_argument("--compare", help="compare the results to the ones in this json file")
+    parser.add_argument("--client-only", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.client_only:
+        # See client_bench.
+        try:
+            print(json.dumps(_client_lookups(args.client_only)))
+        except ImportError as e:
+            print("client dependencies missing: {}".format(e), file=sys.stderr)
+            sys.exit(_missing_client)
+        sys.exit()
+    results, skipped = run()
+    report = {"commit": _commit(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "parser": tsbparser.features,
+              "results": results,
+              "skipped": skipped}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(json.load(f), report)
+    else:
+        print(json.dumps(report, indent=1, sort_keys=True))
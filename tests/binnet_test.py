@@ -0,0 +1,48 @@
+import json
+import os
+import tempfile
+import unittest
+import binnet
+import departures
+import model
+import payload
+import trips
+
+
+class binnet_tests(unittest.TestCase):
+    # The bus network bundled with the server.
+    path = os.path.join(os.path.dirname('__file__'), 'bus_network.json')
+
+    def setUp(self):
+        with open(self.path, 'rb') as f:
+            self.content = f.read()
+        self.network = json.loads(self.content.decode('utf-8'))
+        self.compact = model.from_json(self.network)
+
+    def test_roundtrip(self):
+        binary = binnet.loads(binnet.dumps(self.compact, payload.digest(self.content)))
+        self.assertEqual(binary.version, payload.digest(self.content))
+        self.assertEqual(model.to_json(binary), self.network)
+
+    def test_views(self):
+        with tempfile.NamedTemporaryFile(suffix=".bin") as f:
+            f.write(binnet.dumps(self.compact))
+            f.flush()
+            binary = binnet.load(f.name)
+            self.assertIsNone(binary.version)
+            self.assertEqual(len(binary.buses), len(self.compact.buses))
+            bus = binary.bus(self.compact.buses[3].name)
+            station = bus.rroute.stations[-1]
+            expected = self.compact.buses[3].rroute.stations[-1]
+            self.assertEqual(station.name, expected.name)
+            self.assertEqual(list(station.timetables[0].departures), list(expected.timetables[0].departures))
+            self.assertEqual(binary.bus('no such bus'), None)
+            self.assertEqual(trips.build(binary, departures.weekdays), trips.build(self.compact, departures.weekdays))
+
+    def test_not_binary(self):
+        with self.assertRaises(ValueError):
+            binnet.loads(self.content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import copy
+import datetime
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# The client modules, whose names are also used on the server. Appended,
+# so the server modules come first for the other tests.
+client = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'client')
+sys.path.append(client)
+import board
+spec = importlib.util.spec_from_file_location('client_persistence', os.path.join(client, 'persistence.py'))
+client_persistence = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(client_persistence)
+
+
+class board_tests(unittest.TestCase):
+    # The bus network bundled with the server.
+    path = os.path.join(os.path.dirname('__file__'), 'bus_network.json')
+
+    def setUp(self):
+        with open(self.path, 'r') as f:
+            self.network = json.load(f)
+        # The client keeps its files in the working directory.
+        self.cwd = os.getcwd()
+        self.storage = tempfile.mkdtemp()
+        os.chdir(self.storage)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.storage)
+
+    def bus(self, name, *stations):
+        return {'name': name, 'rroute': [],
+                'droute': [{'name': station, 'timetable': timetable} for station, timetable in stations]}
+
+    def next_departures(self, network, station_name, when, limit=5):
+        # Every timetable of the station, as done before the boards.
+        days = board.day_types[board.day_type(when)]
+        result = []
+        for bus in network['buses']:
+            for direction in ('droute', 'rroute'):
+                for station in bus[direction]:
+                    timetables = dict(station['timetable'])
+                    if station['name'] != station_name:
+                        continue
+                    for day in days:
+                        if day in timetables:
+                            minutes = [board.minutes(hour) for hour in timetables[day]]
+                            result += [(minute, bus['name'], direction) for minute in minutes
+                                       if minute is not None and minute >= when.hour * 60 + when.minute]
+                            break
+        return sorted(result)[:limit]
+
+    def board_departures(self, station_name, when):
+        found = client_persistence.get_board(station_name)
+        return board.next_departures(found, when) if found is not None else []
+
+    def test_part(self):
+        part = board.part(self.bus('b', ('GARA', [['Luni - Vineri', ['07:10', '06:50', 'x']],
+                                                  ['Luni - Duminica', ['12:00']]])))
+        self.assertEqual(part, {'GARA': [['b', 'droute', {'weekdays': [410, 430],
+                                                          'saturdays': [720],
+                                                          'sundays': [720]}]]})
+
+    def test_merge(self):
+        stops = (board.part(self.bus('b', ('GARA', [['Luni - Vineri', ['07:10']]])))['GARA'] +
+                 board.part(self.bus('a', ('GARA', [['Luni - Vineri', ['07:10', '06:00']]])))['GARA'])
+        merged = board.merge('GARA', stops)
+        self.assertEqual(merged['routes'], [['a', 'droute'], ['b', 'droute']])
+        self.assertEqual(merged['weekdays'], {'minutes': [360, 430, 430], 'route': [0, 0, 1]})
+        self.assertEqual(merged['sundays'], {'minutes': [], 'route': []})
+        monday = datetime.datetime(2015, 4, 6, 7, 0)
+        self.assertEqual(board.next_departures(merged, monday), [(430, 'a', 'droute'), (430, 'b', 'droute')])
+        self.assertEqual(board.next_departures(merged, monday, 1), [(430, 'a', 'droute')])
+        self.assertEqual(board.next_departures(merged, monday.replace(day=5)), [])
+
+    def test_boards(self):
+        client_persistence.save_bus_network(self.network)
+        stations = set(station['name'] for bus in self.network['buses']
+                       for direction in ('droute', 'rroute') for station in bus[direction])
+        for when in (datetime.datetime(2015, 4, 1, 7, 0), datetime.datetime(2015, 4, 4, 13, 31),
+                     datetime.datetime(2015, 4, 5, 22, 50)):
+            for station_name in stations:
+                self.assertEqual(board.next_departures(client_persistence.get_board(station_name), when),
+                                 self.next_departures(self.network, station_name, when),
+                                 (station_name, when))
+        self.assertIsNone(client_persistence.get_board('no such station'))
+
+    def test_incremental(self):
+        client_persistence.save_bus_network(self.network)
+        changed = copy.deepcopy(self.network)
+        removed = changed['buses'].pop(3)
+        station_name = changed['buses'][0]['droute'][0]['name']
+        changed['buses'][0]['droute'][0]['timetable'][0][1].append('23:59')
+        written = []
+        write = client_persistence._write
+        def logged(file_name, content):
+            written.append(file_name)
+            write(file_name, content)
+        client_persistence._write = logged
+        try:
+            client_persistence.save_bus_network(changed)
+        finally:
+            client_persistence._write = write
+        # Only the boards of the stations of the changed and removed buses.
+        stations = set(station['name'] for bus in (removed, changed['buses'][0])
+                       for direction in ('droute', 'rroute') for station in bus[direction])
+        boards = set(name for name in written if name.startswith('bus_network_boards' + os.sep)
+                     and name.endswith('.json') and os.sep + 'parts' + os.sep not in name)
+        self.assertLessEqual(boards, set(client_persistence._board_file(name) for name in stations))
+        late = datetime.datetime(2015, 4, 1, 23, 58)
+        self.assertEqual(board.next_departures(client_persistence.get_board(station_name), late),
+                         self.next_departures(changed, station_name, late))
+        for station in removed['droute']:
+            found = client_persistence.get_board(station['name'])
+            if found is not None:
+                self.assertNotIn(removed['name'], [route[0] for route in found['routes']])
+
+    def save_interrupted(self, network):
+        # As if the app was killed while merging the boards.
+        save_boards = client_persistence._save_boards
+        def killed(old, buses):
+            raise KeyboardInterrupt()
+        client_persistence._save_boards = killed
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                client_persistence.save_bus_network(network)
+        finally:
+            client_persistence._save_boards = save_boards
+
+    def test_interrupted(self):
+        client_persistence.save_bus_network(self.network)
+        changed = copy.deepcopy(self.network)
+        removed = changed['buses'].pop(3)
+        station_name = removed['droute'][0]['name']
+        when = datetime.datetime(2015, 4, 1, 7, 0)
+        # Merged again on the next save, even of the same bus network.
+        self.save_interrupted(changed)
+        client_persistence.save_bus_network(changed)
+        self.assertEqual(self.board_departures(station_name, when),
+                         self.next_departures(changed, station_name, when))
+        # Or when first needed.
+        self.save_interrupted(self.network)
+        self.assertEqual(self.board_departures(station_name, when),
+                         self.next_departures(self.network, station_name, when))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,50 @@
 import unittest
 import data
 import tests.utils_mock as utils_mock
-import os
 
 # Return html files from local storage.
-tsb.htmlget = utils_mock.htmlget
+data.htmlget = utils_mock.htmlget
 
 class tsb_tests(unittest.TestCase):
 
-    def test_news(self):
-        res = data.news()
-        self.assertEqual(len(res), 3)
-        self.assertEqual(res[0]['publishdate'], "12 Feb 2015")
-        self.assertTrue('Incepand cu data de 16.02.2015' in res[0]['newscontent'])
- 
+    def test_bus_network(self):
+        serial = data.bus_network(workers=1, processes=0)
+        parallel = data.bus_network(workers=8, processes=4)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(len(parallel['buses']), 21)
+        self.assertEqual(len(parallel['buses'][0]['droute']), 17)
+        self.assertEqual(len(parallel['buses'][0]['rroute']), 24)
+        self.assertEqual(parallel['update'], 'Program de circulatie incepand cu data de 23 martie 2015')
 
-#if __name__ == '__main__':
-unittest.main()
+    def test_rebuild(self):
+        network, hashes, report = data.rebuild()
+        self.assertEqual(report, {'fetched': 1 + 21 + 21 * 41, 'parsed': 1 + 21 + 21 * 41, 'reused': 0})
+        # Nothing changed, all the buses are reused.
+        rebuilt, rehashes, report = data.rebuild(network, hashes)
+        self.assertEqual(rebuilt, network)
+        self.assertEqual(rehashes, hashes)
+        self.assertEqual(report, {'fetched': 1 + 21, 'parsed': 1, 'reused': 21})
+        # One bus page changed, but none of its station pages did.
+        hashes['routes']['http://tursib.ro/traseu/14'] = "changed"
+        rebuilt, rehashes, report = data.rebuild(network, hashes)
+        self.assertEqual(rebuilt, network)
+        self.assertEqual(report, {'fetched': 1 + 21 + 41, 'parsed': 2, 'reused': 20 + 41})
+        # Deep rebuilds download all the station pages, but only parse the changed ones.
+        rebuilt, rehashes, report = data.rebuild(network, hashes, tursib_ro_trasee=data.trasee(), deep=True)
+        self.assertEqual(rebuilt, network)
+        self.assertEqual(report, {'fetched': 21 + 21 * 41, 'parsed': 1 + 21, 'reused': 21 * 41})
+
+    def test_fingerprint(self):
+        network, hashes, report = data.rebuild()
+        self.assertEqual(hashes['trasee'], data.fingerprint(data.trasee()))
+        # Changes outside the update string and the bus list are ignored.
+        self.assertEqual(data.fingerprint(data.trasee().replace('</body>', '<p>news</p></body>')),
+                         hashes['trasee'])
+        self.assertNotEqual(data.fingerprint(data.trasee().replace('Program de circulatie', 'Program')),
+                            hashes['trasee'])
+        self.assertFalse(data.routes_changed(hashes))
+        hashes['routes']['http://tursib.ro/traseu/14'] = "changed"
+        self.assertTrue(data.routes_changed(hashes))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import copy
+import json
+import os
+import unittest
+import delta
+
+
+class delta_tests(unittest.TestCase):
+    # The bus network bundled with the server.
+    path = os.path.join(os.path.dirname('__file__'), 'bus_network.json')
+
+    def setUp(self):
+        with open(self.path, 'r') as f:
+            self.old = json.load(f)
+        self.new = copy.deepcopy(self.old)
+
+    def roundtrip(self):
+        changes = delta.diff(self.old, self.new)
+        self.assertEqual(delta.apply(self.old, changes), self.new)
+        return changes
+
+    def test_unchanged(self):
+        changes = self.roundtrip()
+        self.assertTrue(all(isinstance(bus, str) for bus in changes['buses']))
+        self.assertEqual(changes['removed'], [])
+
+    def test_changed_timetable(self):
+        station = self.new['buses'][3]['rroute'][5]
+        station['timetable'][0][1].append('23:59')
+        changes = self.roundtrip()
+        bus = changes['buses'][3]
+        self.assertEqual(bus['rroute'][5], station)
+        self.assertEqual(bus['rroute'][4], 4)
+        self.assertEqual(bus['droute'], list(range(len(bus['droute']))))
+        # Only the changed station is sent in full.
+        self.assertLess(len(json.dumps(changes)), 5000)
+
+    def test_added_removed_reordered(self):
+        removed = self.new['buses'].pop(0)
+        added = {'name': '99 - Nou', 'droute': self.new['buses'][0]['droute'][:3], 'rroute': []}
+        self.new['buses'].insert(5, added)
+        self.new['buses'][1]['droute'].reverse()
+        self.new['update'] = 'Program nou'
+        changes = self.roundtrip()
+        self.assertEqual(changes['removed'], [removed['name']])
+        self.assertEqual(changes['buses'][5], added)
+
+
+if __name__ == '__main__':
+    unittest.main()
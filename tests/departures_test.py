@@ -0,0 +1,43 @@
+import datetime
+import json
+import os
+import unittest
+import departures
+import model
+
+
+class departures_tests(unittest.TestCase):
+    # The bus network bundled with the server.
+    path = os.path.join(os.path.dirname('__file__'), 'bus_network.json')
+
+    @classmethod
+    def setUpClass(cls):
+        with open(cls.path, 'r') as f:
+            cls.stations = departures.build(model.from_json(json.load(f)))
+
+    def test_day_types(self):
+        self.assertEqual(departures.day_types(datetime.date(2016, 9, 16))[0], 'Luni - Vineri')
+        self.assertEqual(departures.day_types(datetime.date(2016, 9, 17))[0], 'Sambata')
+        self.assertEqual(departures.day_types(datetime.date(2016, 9, 18))[0], 'Duminica')
+
+    def test_next_departures(self):
+        monday = datetime.datetime(2016, 9, 12, 7, 30)
+        result = departures.next_departures(self.stations, 'GARA', monday, 5)
+        self.assertEqual(result[0], (450, '17 - Strand - Gara', 'droute'))
+        self.assertEqual([minute for minute, bus, direction in result], [450, 450, 452, 452, 453])
+
+    def test_whole_week_timetable(self):
+        # Bus 22 has a single timetable, valid on sundays too.
+        sunday = datetime.datetime(2016, 9, 18, 0, 0)
+        result = departures.next_departures(self.stations, 'PALTINIS', sunday, 50)
+        self.assertTrue(result)
+        self.assertTrue(all(bus == '22 - Sibiu - Paltinis' for minute, bus, direction in result))
+
+    def test_unknown_station_and_late(self):
+        monday = datetime.datetime(2016, 9, 12, 23, 59)
+        self.assertEqual(departures.next_departures(self.stations, 'NOWHERE', monday), [])
+        self.assertEqual(departures.next_departures(self.stations, 'PALTINIS', monday), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import json
+import os
+import unittest
+import index
+
+
+class index_tests(unittest.TestCase):
+    # The bus network bundled with the server.
+    path = os.path.join(os.path.dirname('__file__'), 'bus_network.json')
+
+    @classmethod
+    def setUpClass(cls):
+        with open(cls.path, 'r') as f:
+            cls.network = json.load(f)
+        cls.stations = index.stations(cls.network)
+
+    def test_build(self):
+        built = index.build(self.network)
+        self.assertEqual(len(built['buses']), 22)
+        route = built['stations'][('11 - Calea Cisnadiei - SC Continental', 'droute')]
+        self.assertEqual(route['TURNISOR']['name'], 'TURNISOR')
+
+    def test_normalize(self):
+        self.assertEqual(index.normalize('Piața  Unirii'), 'PIATA UNIRII')
+        self.assertEqual(index.normalize('PODULUI  I'), 'PODULUI I')
+        self.assertEqual(index.normalize('COMPA II/I'), 'COMPA II I')
+
+    def test_stations(self):
+        gara = self.stations['GARA']
+        self.assertEqual(gara['name'], 'GARA')
+        self.assertIn(['5 - Valea Aurie - Gara', 'rroute', 0], gara['stops'])
+        self.assertEqual(len(gara['stops']), 12)
+
+    def test_find(self):
+        self.assertEqual(index.find(self.stations, 'gara'), ['GARA'])
+        self.assertEqual(index.find(self.stations, 'Piata Ciibin I')[0], 'PIATA CIBIN I')
+        self.assertEqual(index.find(self.stations, 'nowhere at all'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import json
+import os
+import unittest
+import model
+
+
+class model_tests(unittest.TestCase):
+    # The bus network bundled with the server.
+    path = os.path.join(os.path.dirname('__file__'), 'bus_network.json')
+
+    def test_roundtrip(self):
+        with open(self.path, 'r') as f:
+            network = json.load(f)
+        self.assertEqual(model.to_json(model.from_json(network)), network)
+
+    def test_notes_and_order(self):
+        network = {'update': 'u', 'buses': [{'name': 'b', 'rroute': [], 'droute': [
+            {'name': 's', 'timetable': [['Luni - Vineri', ['10:00', 'La orele marcate cu', '09:00', '08:30']],
+                                        ['Sambata', []]]}]}]}
+        compact = model.from_json(network)
+        timetable = compact.buses[0].droute.stations[0].timetables[0]
+        self.assertEqual(list(timetable.departures), [510, 540, 600])
+        self.assertEqual(timetable.notes, ((1, 'La orele marcate cu'),))
+        self.assertEqual(model.to_json(compact), network)
+
+    def test_minutes(self):
+        self.assertEqual(model.minutes('00:00'), 0)
+        self.assertEqual(model.minutes('23:59'), 1439)
+        self.assertEqual(model.minutes('\xa0'), None)
+        self.assertEqual(model.hour(425), '07:05')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 import os
-import parser
+import tsbparser as parser
 
 
 class parser_tests(unittest.TestCase):
@@ -14,43 +14,6 @@ class parser_tests(unittest.TestCase):
         f.close()
         return read
 
-    def test_news_content(self):
-        data = [
-            {'in': 'news_160.htm',   # Valid tursib page containing news.
-             'exp': {'publishdate': '12 Feb 2015','newscontent': 'Incepand cu data de 16.02.2015, se inchide circulatia'}},
-            {'in': 'tursib_ro.htm',  # Tursib page that does not contain any news.
-             'exp': {'publishdate': None, 'newscontent': None}},
-            {'in': 'dummy_file.txt', # Invalid / random file.
-             'exp': {'publishdate': None, 'newscontent': None}},
-            {'in': 'news_160_missing_publishdate_header.htm', # Modified the remove the 'publishdate' field.
-             'exp': {'publishdate': None, 'newscontent': None}},
-        ]
-        for entry in data:
-             f = self.fileread(entry['in'])
-             parsed = parser.news_content(f)
-             self.assertEqual(parsed['publishdate'], entry['exp']['publishdate'])
-             # If there is something to compare
-             if parsed['newscontent'] and entry['exp']['newscontent']:
-                 # Only check part of the news, as these can get quite big.
-                 self.assertTrue(entry['exp']['newscontent'] in parsed['newscontent'])
-             else:
-                 # No news content, but is that what we exp?
-                 self.assertEqual(entry['exp']['newscontent'], parsed['newscontent'])
-                 
-
-    def test_news_links(self):
-        data = [
-            {'in': 'tursib_ro.htm', # Valid tursib page containing links to news.
-             'exp': ['http://tursib.ro/news/show/161', 'http://tursib.ro/news/show/160', 'http://tursib.ro/news/show/159']},
-            {'in': 'dummy_file.txt', # Invalid / random file.
-             'exp': []}
-        ]
-        for entry in data:
-            f = self.fileread(entry['in'])
-            parsed = parser.news_links(f)
-            self.assertEqual(entry['exp'], parsed)
-       
-
     def test_update_string(self):
         data = [
             {'in': 'tursib_ro_trasee.htm', # Valid tursib page containing info regarding the last update.
@@ -124,20 +87,36 @@ class parser_tests(unittest.TestCase):
     def test_station_timetable(self):
         data = [
             {'in': 'tursib_ro_traseu_112_Bosch.htm', # Valid page.
-             'exp': {'sunday': ['07:26', '19:26'], # Expected output.
-                     'saturday': ['07:26', '19:26'], 
-                     'weekdays': ['07:26', '08:31', '15:26', '16:31', '17:41', '23:26']}},
+             'exp': [['Luni - Vineri', ['07:26', '08:31', '15:26', '16:31', '17:41', '23:26']], # Expected output.
+                     ['Sambata', ['07:26', '19:26']],
+                     ['Duminica', ['07:26', '19:26']]]},
             {'in': 'tursib_ro.htm', # Tursib page that does not contain the data of interest.
-             'exp': {'sunday': [], 'saturday': [], 'weekdays': []}},
+             'exp': []},
             {'in': 'dummy_file.txt', # Invalid / random file
-             'exp': {'sunday': [], 'saturday': [], 'weekdays': []}}
+             'exp': []}
         ]
         for entry in data:
             f = self.fileread(entry['in'])
             parsed = parser.station_timetable(f)
             self.assertEqual(entry['exp'], parsed)
              
+    def test_fast(self):
+        # Parsing only the needed parts of the pages gives the same results,
+        # with lxml and with the html parser from the standard library.
+        self.addCleanup(setattr, parser, 'fast', parser.fast)
+        self.addCleanup(setattr, parser, 'features', parser.features)
+        functions = [parser.update_string, parser.buses_list, parser.bus_stations, parser.station_timetable]
+        for features in ("lxml", "html.parser"):
+            parser.features = features
+            for name in os.listdir(self.samples):
+                f = self.fileread(name)
+                for function in functions:
+                    parser.fast = False
+                    full = function(f)
+                    parser.fast = True
+                    self.assertEqual(full, function(f), (features, name, function.__name__))
+
 
-#if __name__ == '__main__':
-unittest.main()
+if __name__ == '__main__':
+    unittest.main()
 
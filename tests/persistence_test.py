@@ -0,0 +1,90 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import binnet
+import model
+import payload
+import persistence
+
+
+class persistence_tests(unittest.TestCase):
+    # The bus network bundled with the server.
+    path = os.path.join(os.path.dirname('__file__'), 'bus_network.json')
+
+    def setUp(self):
+        with open(self.path, 'r') as f:
+            self.network = json.load(f)
+        # Store everything in a temporary directory instead of next to the module.
+        self.storage = tempfile.mkdtemp()
+        self._path = persistence._path
+        persistence._path = lambda file_name: os.path.join(self.storage, file_name)
+
+    def tearDown(self):
+        persistence._path = self._path
+        shutil.rmtree(self.storage)
+
+    def saved(self):
+        with open(os.path.join(self.storage, 'bus_network.json'), 'rb') as f:
+            return f.read()
+
+    def test_save_network(self):
+        persistence.save_network(self.network)
+        self.assertEqual(self.saved(), json.dumps(self.network).encode('utf-8'))
+        self.assertEqual(persistence.get_network(), self.network)
+        self.assertEqual(persistence.get_network_version(), payload.digest(self.saved()))
+        self.assertEqual(persistence.get_network_update(), self.network['update'])
+        self.assertEqual(sorted(os.listdir(self.storage)),
+                         ['bus_network.bin', 'bus_network.json', 'bus_network_stations.json',
+                          'bus_network_update.json', 'history'])
+
+    def test_binary_network(self):
+        persistence.save_network(self.network)
+        network = persistence.get_model()
+        self.assertIsInstance(network, binnet.Network)
+        self.assertEqual(network.version, persistence.get_network_version())
+        self.assertEqual(model.to_json(network), self.network)
+
+    def test_manifest(self):
+        persistence.save_network(self.network)
+        manifest = json.loads(persistence.get_manifest()['identity'].decode('utf-8'))
+        self.assertEqual(manifest['version'], persistence.get_network_version())
+        self.assertEqual([bus['name'] for bus in manifest['buses']], [bus['name'] for bus in self.network['buses']])
+        # The same as the ETag of the bus.
+        bus = self.network['buses'][3]
+        self.assertEqual(manifest['buses'][3]['hash'],
+                         persistence.get_prepared(("bus", bus['name']), lambda: bus)['etag'])
+        # Whatever the order of the keys, as in another server process.
+        reordered = dict(reversed(list(bus.items())))
+        self.assertEqual(manifest['buses'][3]['hash'], payload.digest(payload.dumps(reordered)))
+
+    def test_history(self):
+        persistence.save_network(self.network)
+        old = persistence.get_network_version()
+        new = copy.deepcopy(self.network)
+        new['update'] = 'Program nou'
+        persistence.save_network(new)
+        self.assertEqual(persistence.get_network_update(), 'Program nou')
+        self.assertEqual(sorted(os.listdir(os.path.join(self.storage, 'history'))),
+                         sorted([old + '.json', persistence.get_network_version() + '.json']))
+        self.assertEqual(json.loads(persistence.get_network_delta(old)['identity'].decode('utf-8'))['update'],
+                         'Program nou')
+
+    def test_failed_save(self):
+        persistence.save_network(self.network)
+        before = self.saved()
+        broken = copy.deepcopy(self.network)
+        broken['buses'].append(object())
+        with self.assertRaises(TypeError):
+            persistence.save_network(broken)
+        # The saved network is left as it was, without temporary files.
+        self.assertEqual(self.saved(), before)
+        self.assertEqual(sorted(os.listdir(self.storage)),
+                         ['bus_network.bin', 'bus_network.json', 'bus_network_stations.json',
+                          'bus_network_update.json', 'history'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import datetime
+import json
+import os
+import unittest
+import departures
+import model
+import planner
+
+
+class planner_tests(unittest.TestCase):
+    # The bus network bundled with the server.
+    path = os.path.join(os.path.dirname('__file__'), 'bus_network.json')
+
+    @classmethod
+    def setUpClass(cls):
+        with open(cls.path, 'r') as f:
+            network = model.from_json(json.load(f))
+        monday = departures.day_types(datetime.date(2016, 9, 12))
+        cls.connections = planner.build(network, monday)
+
+    def journey(self, origin, destination, hour):
+        ids = self.connections['stop_ids']
+        legs = planner.journey(self.connections, ids[origin], ids[destination], model.minutes(hour))
+        return [(self.connections['trips'][trip][0], self.connections['stops'][start], model.hour(departure),
+                 self.connections['stops'][end], model.hour(arrival))
+                for trip, start, departure, end, arrival in legs]
+
+    def test_sorted(self):
+        departure = list(self.connections['departure'])
+        self.assertEqual(departure, sorted(departure))
+
+    def test_direct(self):
+        # Bus 11 leaves Calea Cisnadiei at 07:09, 26 minutes before
+        # reaching SC Continental, as the 06:49 one does at 07:15.
+        self.assertEqual(self.journey('CALEA CISNADIEI', 'SC CONTINENTAL', '07:00'),
+                         [('11 - Calea Cisnadiei - SC Continental', 'CALEA CISNADIEI', '07:09',
+                           'SC CONTINENTAL', '07:35')])
+
+    def test_transfer(self):
+        # Bus 1 reaches Piata Aurel Vlaicu I at 07:15, bus 13 leaves from
+        # there at 07:18 and reaches the railway station at 07:26.
+        self.assertEqual(self.journey('CALEA CISNADIEI', 'GARA', '07:00'),
+                         [('1 - Cimitir  - Hornbach/Viile Sibiului', 'CALEA CISNADIEI', '07:09',
+                           'PIATA AUREL VLAICU I', '07:15'),
+                          ('13 - Gara - Dumbrava/Muzeul Astra', 'PIATA AUREL VLAICU I', '07:18',
+                           'GARA', '07:26')])
+
+    def test_unreachable(self):
+        # Bus 22 has a single station on each route.
+        self.assertEqual(self.journey('GARA', 'PALTINIS', '07:00'), [])
+        self.assertEqual(self.journey('GARA', 'GARA', '07:00'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import fcntl
+import os
+import shutil
+import tempfile
+import unittest
+import persistence
+import refresh
+
+
+class refresh_tests(unittest.TestCase):
+
+    def setUp(self):
+        # Keep the lock and the status in a temporary directory.
+        self.storage = tempfile.mkdtemp()
+        self._path, self._lock_file, self._running_file, self._update = (
+            persistence._path, refresh._lock_file, refresh._running_file, refresh._update)
+        persistence._path = lambda file_name: os.path.join(self.storage, file_name)
+        refresh._lock_file = os.path.join(self.storage, "refresh.lock")
+        refresh._running_file = os.path.join(self.storage, "refresh.running")
+
+    def tearDown(self):
+        persistence._path, refresh._lock_file, refresh._running_file, refresh._update = (
+            self._path, self._lock_file, self._running_file, self._update)
+        shutil.rmtree(self.storage)
+
+    def test_success(self):
+        refresh._update = lambda full, deep: "updated, full {}".format(full)
+        self.assertEqual(refresh.refresh(full=True), "updated, full True")
+        status = refresh.status()
+        self.assertFalse(status["running"])
+        self.assertEqual(status["last_success"]["result"], "updated, full True")
+        self.assertNotIn("last_error", status)
+
+    def test_error(self):
+        def fail(full, deep):
+            raise ValueError("tursib.ro is down")
+        refresh._update = fail
+        with self.assertRaises(ValueError):
+            refresh.refresh()
+        status = refresh.status()
+        self.assertFalse(status["running"])
+        self.assertEqual(status["last_error"]["error"], "ValueError: tursib.ro is down")
+
+    def test_failed_save(self):
+        # The hashes are not saved for a network that could not be.
+        refresh._update = self._update
+        rebuild, trasee, save_network = refresh.data.rebuild, refresh.data.trasee, persistence.save_network
+        def failed_save(network):
+            raise OSError("No space left on device")
+        refresh.data.rebuild = lambda *args, **kwargs: ({"update": "", "buses": []}, {"trasee": "new"},
+                                                         {"fetched": 1, "parsed": 1, "reused": 0})
+        refresh.data.trasee = lambda: ""
+        persistence.save_network = failed_save
+        try:
+            with self.assertRaises(OSError):
+                refresh.refresh(full=True)
+        finally:
+            refresh.data.rebuild, refresh.data.trasee, persistence.save_network = rebuild, trasee, save_network
+        self.assertIsNone(persistence.get_hashes())
+
+    def test_single_flight(self):
+        refresh._update = lambda full, deep: self.fail("refreshed while another process is at it")
+        with open(refresh._lock_file, 'a') as lock, open(refresh._running_file, 'a') as running:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            fcntl.flock(running, fcntl.LOCK_EX)
+            self.assertIsNone(refresh.refresh())
+            self.assertTrue(refresh.status()["running"])
+
+    def test_status_leaves_lock_alone(self):
+        # A refresh about to start holds the lock, status must not need it.
+        with open(refresh._lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.assertFalse(refresh.status()["running"])
+        refresh._update = lambda full, deep: refresh.status()["running"]
+        self.assertTrue(refresh.refresh())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import json
+import os
+import unittest
+import departures
+import model
+import trips
+
+
+class trips_tests(unittest.TestCase):
+    # The bus network bundled with the server.
+    path = os.path.join(os.path.dirname('__file__'), 'bus_network.json')
+
+    def network(self, *stations):
+        route = [{'name': str(position), 'timetable': [['Luni - Vineri', hours]]}
+                 for position, hours in enumerate(stations)]
+        return model.from_json({'update': '', 'buses': [{'name': 'b', 'droute': route, 'rroute': []}]})
+
+    def test_align(self):
+        table = trips.build(self.network(['07:00', '07:10', '07:20'],
+                                         ['07:05', '07:15', '07:25'],
+                                         ['07:08', '07:18', '07:58']),
+                            departures.weekdays)
+        self.assertEqual(table['trips'], [('b', 'droute', 0), ('b', 'droute', 0), ('b', 'droute', 0), ('b', 'droute', 2)])
+        self.assertEqual([list(times) for times in table['times']],
+                         [[420, 425, 428], [430, 435, 438], [440, 445], [478]])
+        # The third bus stops at the second station, the 07:58 one starts at the third.
+        self.assertEqual(table['anomalies'], [('b', 'droute', 1, 445, 'ends'), ('b', 'droute', 2, 478, 'starts')])
+
+    def test_network(self):
+        with open(self.path, 'r') as f:
+            network = model.from_json(json.load(f))
+        table = trips.build(network, departures.weekdays)
+        departures_count = sum(len(times) for times in table['times'])
+        expected = sum(len(trips._departures(station, departures.weekdays))
+                       for bus in network.buses for route in (bus.droute, bus.rroute)
+                       for station in route.stations)
+        # Every departure belongs to exactly one trip.
+        self.assertEqual(departures_count, expected)
+        for times in table['times']:
+            self.assertEqual(list(times), sorted(times))
+
+
+if __name__ == '__main__':
+    unittest.main()
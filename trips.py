@@ -0,0 +1,82 @@
+# Trips rebuilt from the station timetables.
+#
+# tursib.ro publishes the departures from every station independently,
+# so which departure from a station continues as which departure from
+# the next station on the route is not known. Here the departures from
+# consecutive stations are aligned: a departure continues as the first
+# departure from the next station at most max_hop minutes later, and the
+# departures are kept in order, so two buses never overtake each other.
+# A run of aligned departures from consecutive stations is a trip.
+#
+# Departures that can not be aligned are reported as anomalies: a trip
+# ending before the last station of the route or starting after its
+# first station. These are often genuine (buses going only part of the
+# route), but can also point to typos in the timetables.
+
+from array import array
+
+# Longest time, in minutes, between two consecutive stations of a trip.
+max_hop = 30
+
+def build(network, days):
+    """
+    The trips of the compact bus network (see model.py) on the days using
+    the given timetables (see departures.day_types). Returns a dictionary
+    with, for every trip, the bus name, the direction and the position on
+    the route of its first station ("trips") and the departures from its
+    stations, in minutes since midnight ("times"). The anomalies found are
+    listed as (bus name, direction, position, minute, "starts" or "ends")
+    tuples ("anomalies").
+    """
+    result = {"trips": [], "times": [], "anomalies": []}
+    for bus in network.buses:
+        for route in (bus.droute, bus.rroute):
+            times = [_departures(station, days) for station in route.stations]
+            _align(bus.name, route.direction, times, result)
+    return result
+
+def _departures(station, days):
+    for timetable in station.timetables:
+        if timetable.day in days:
+            return timetable.departures
+    return array('H')
+
+def _align(bus, direction, times, result):
+    # The trips still running, by the index of their departure from the
+    # current station.
+    running = {}
+    last = len(times) - 1
+    for position, here in enumerate(times):
+        there = times[position + 1] if position < last else ()
+        hops = dict(_hops(here, there))
+        arriving = {}
+        for i, departure in enumerate(here):
+            trip = running.get(i)
+            if trip is None:
+                trip = array('H')
+                result["trips"].append((bus, direction, position))
+                result["times"].append(trip)
+                if position > 0:
+                    result["anomalies"].append((bus, direction, position, departure, "starts"))
+            trip.append(departure)
+            if i in hops:
+                arriving[hops[i]] = trip
+            elif position < last:
+                result["anomalies"].append((bus, direction, position, departure, "ends"))
+        running = arriving
+
+def _hops(here, there):
+    """
+    Pair the departures from a station with the departures from the
+    next one, keeping them in order and at most max_hop minutes apart.
+    Yields the indexes of the paired departures.
+    """
+    following = 0
+    for i, departure in enumerate(here):
+        while following < len(there) and there[following] < departure:
+            following += 1
+        if following == len(there):
+            break
+        if there[following] - departure <= max_hop:
+            yield i, following
+            following += 1
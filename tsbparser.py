@@ -5,19 +5,52 @@
 # Please consult these html pages for a better understanding of the 
 # algorithms implemented to extract the needed data.
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import utils
+try:
+    import lxml
+    # Much faster than the html parser from the standard library, and
+    # the one BeautifulSoup picks by default when installed anyway.
+    features = "lxml"
+except ImportError:
+    features = "html.parser"
+
+# When fast is set, only the parts of the pages needed by each function
+# are turned into a tree (see SoupStrainer in the BeautifulSoup docs),
+# which is most of the work. Set it to False to build the whole tree.
+fast = True
 
 ## The function parameter to all the functions is a html string.
 ## The name of the parameter indicates the source of the string, 
 ## that is, tursib_ro_trasee is a html page from www.tursib.ro/trasee.
 ## Each function returns either a list or a dictionary.
 
+def _soup(html, only=None):
+    """
+    Parse the html page, or only the parts of it matching the strainer.
+    """
+    if not fast:
+        only = None
+    return BeautifulSoup(html, features, parse_only=only)
+
+
+def _css_class(name):
+    """
+    Match elements with this css class among others, as in class="plecari t11".
+    The class can be given as a string or, once parsed, as a list.
+    """
+    def match(value):
+        if not value:
+            return False
+        return name in (value.split() if isinstance(value, str) else value)
+    return match
+
+
 def update_string(tursib_ro_trasee):
     """
     Extract the string of the last update to the busses routes and timetables.
     """
-    bs = BeautifulSoup(tursib_ro_trasee)
+    bs = _soup(tursib_ro_trasee, SoupStrainer("h2", {"style": "color:#900;"}))
     result = [h2.text for h2 in bs.find_all("h2", {"style": "color:#900;"})]
     if result:
         return result[0]
@@ -32,7 +65,7 @@ def buses_list(tursib_ro_trasee_html):
     containing further info for the bus, like the station names.
     """
     result = []
-    bs = BeautifulSoup(tursib_ro_trasee_html)
+    bs = _soup(tursib_ro_trasee_html)
     # The buses are grouped in four major categories: main,secondary,
     # professional and touristic routes, respectively. Each of these 
     # categories has his own html table starting with a h3 header 
@@ -55,7 +88,7 @@ def bus_stations(tursib_ro_traseu_x):
     Returns a list of direct and reverse routes containing the station name and link.
     """
     result = {"directroutes": [], "reverseroutes": []}
-    bs = BeautifulSoup(tursib_ro_traseu_x)
+    bs = _soup(tursib_ro_traseu_x, SoupStrainer('table', {'class': _css_class('statii')}))
     # Each bus has one direct route and one reverse route. These usually do not contain the same station names.
     all_stations = bs.find_all('table', {'class': 'statii'})
     if not len(all_stations) == 2:
@@ -92,7 +125,7 @@ def station_timetable(tursib_ro_traseu_statie):
     # Every element consists of a list of two elements,
     # the timetable name (i.e. day) and the timetable hours.
     result = []
-    bs = BeautifulSoup(tursib_ro_traseu_statie)
+    bs = _soup(tursib_ro_traseu_statie, SoupStrainer('div', {'class': _css_class('plecari')}))
     timetables = [div.find_all('div') 
                for div in bs.find_all('div', {'class': 'plecari'})]
     timetables_count = len(timetables)
@@ -1,23 +1,222 @@
 import urllib.parse
 import urllib.request
+import hashlib
+import json
 import logging
+import os
+import threading
+import time
 
 # Tursib official website.
 base = "http://www.tursib.ro"
 
+# Maximum number of requests per second sent to the same host.
+# Set to 0 to disable the rate limit.
+rate_limit = 10
+# Number of times a failed request is retried and the delay, in seconds,
+# before the first retry. The delay doubles after every failed attempt.
+retries = 3
+backoff = 0.5
+# Seconds to wait for a response before giving up on the request.
+timeout = 30
+
+# Downloaded pages are kept on disk in cache_dir. Set it to None to
+# disable the cache. Pages younger than cache_ttl seconds are served
+# without asking the server, older ones are revalidated with a
+# conditional request. Pages not used for cache_max_age seconds are
+# evicted, as are the least recently used ones once the cache grows
+# past cache_max_size bytes.
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".htmlcache")
+cache_ttl = 60
+cache_max_age = 30 * 24 * 3600
+cache_max_size = 50 * 1024 * 1024
+# Pages served from the cache (hits), served from the cache after the
+# server confirmed they did not change (revalidated) and downloaded (misses).
+cache_stats = {"hits": 0, "revalidated": 0, "misses": 0}
+
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# The function accepts relative addresses and 
-# merely apends these to the base address. It 
-# then returns the content of the page found 
+# Earliest moment the next request to each host is allowed.
+_next_request = {}
+_next_request_lock = threading.Lock()
+_cache_lock = threading.Lock()
+# Pages stored since the last eviction, see _cache_store.
+_evict_every = 100
+_stored = 0
+
+# The function accepts relative addresses and
+# merely apends these to the base address. It
+# then returns the content of the page found
 # at the address thus constructed.
+# Safe to call from multiple threads at once.
 def htmlget(address):
     path = urllib.parse.urljoin(base, address)
+    entry = _cache_get(path)
+    if entry and time.time() - entry['fetched'] < cache_ttl:
+        _count("hits")
+        return entry['body']
     req = urllib.request.Request(path)
+    if entry and entry['etag']:
+        req.add_header("If-None-Match", entry['etag'])
+    if entry and entry['last_modified']:
+        req.add_header("If-Modified-Since", entry['last_modified'])
+    for attempt in range(retries + 1):
+        _throttle(urllib.parse.urlparse(path).netloc)
+        try:
+            response = urllib.request.urlopen(req, timeout=timeout)
+            body = response.read()
+            _count("misses")
+            _cache_store(path, body, response.headers)
+            return body
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and entry:
+                _count("revalidated")
+                # A 304 need not repeat the validators, keep the ones known.
+                _cache_store(path, entry['body'],
+                             {"ETag": e.headers.get("ETag") or entry['etag'],
+                              "Last-Modified": e.headers.get("Last-Modified") or entry['last_modified']})
+                return entry['body']
+            # Only server errors are worth another try.
+            if e.code < 500 or attempt == retries:
+                logger.info("{} could not be found".format(path))
+                return ""
+        except (urllib.error.URLError, OSError) as e:
+            if attempt == retries:
+                raise
+        delay = backoff * 2 ** attempt
+        logger.info("{} failed, retrying in {}s".format(path, delay))
+        time.sleep(delay)
+
+def _throttle(host):
+    """
+    Wait until the rate limit allows a new request to the given host.
+    """
+    if not rate_limit:
+        return
+    with _next_request_lock:
+        now = time.time()
+        slot = max(now, _next_request.get(host, now))
+        _next_request[host] = slot + 1.0 / rate_limit
+    if slot > now:
+        time.sleep(slot - now)
+
+def _count(stat):
+    with _cache_lock:
+        cache_stats[stat] += 1
+
+## The cache keeps one small json file for every url, under urls/, with
+## the validators sent by the server and the hash of the page content.
+## The pages themselves are stored under pages/, named after their content
+## hash, so identical pages are only stored once.
+
+def _sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+def _url_file(path):
+    return os.path.join(cache_dir, "urls", _sha1(path.encode()) + ".json")
+
+def _page_file(content):
+    return os.path.join(cache_dir, "pages", content)
+
+def _cache_get(path):
+    """
+    Return the cached entry for the url together with the page body,
+    or None if the url is not cached.
+    """
+    if not cache_dir:
+        return None
+    try:
+        with open(_url_file(path), 'r') as f:
+            entry = json.load(f)
+        with open(_page_file(entry['content']), 'rb') as f:
+            entry['body'] = f.read()
+        # The modification time of the url file tracks its last use.
+        os.utime(_url_file(path))
+        return entry
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _cache_store(path, body, headers):
+    global _stored
+    if not cache_dir:
+        return
+    if isinstance(body, str):
+        body = body.encode()
+    content = _sha1(body)
+    entry = {"url": path,
+             "content": content,
+             "etag": headers.get("ETag"),
+             "last_modified": headers.get("Last-Modified"),
+             "fetched": time.time()}
+    try:
+        if not os.path.exists(_page_file(content)):
+            _write(_page_file(content), body)
+        _write(_url_file(path), json.dumps(entry).encode())
+    except OSError as e:
+        logger.info("could not cache {}: {}".format(path, e))
+        return
+    with _cache_lock:
+        _stored += 1
+        evict = _stored >= _evict_every
+        if evict:
+            _stored = 0
+    if evict:
+        cache_evict()
+
+def _write(file_name, content):
+    """
+    Write the file under a temporary name first, so that other threads
+    or processes never read a partially written file.
+    """
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    temp = "{}.{}.{}".format(file_name, os.getpid(), threading.get_ident())
+    with open(temp, 'wb') as f:
+        f.write(content)
+    os.replace(temp, file_name)
+
+def cache_evict():
+    """
+    Remove the pages not used for cache_max_age seconds, then the least
+    recently used ones until the cache fits in cache_max_size bytes.
+    """
+    urls_dir = os.path.join(cache_dir, "urls")
+    pages_dir = os.path.join(cache_dir, "pages")
+    if not os.path.isdir(urls_dir):
+        return
+    entries = []
+    for name in os.listdir(urls_dir):
+        file_name = os.path.join(urls_dir, name)
+        try:
+            with open(file_name, 'r') as f:
+                content = json.load(f)['content']
+            entries.append((os.path.getmtime(file_name), file_name, content))
+        except (OSError, ValueError, KeyError):
+            continue
+    # Most recently used first.
+    entries.sort(reverse=True)
+    now = time.time()
+    size = 0
+    kept = set()
+    for used, file_name, content in entries:
+        if content not in kept:
+            try:
+                page_size = os.path.getsize(_page_file(content))
+            except OSError:
+                page_size = 0
+        else:
+            page_size = 0
+        if now - used > cache_max_age or size + page_size > cache_max_size:
+            _remove(file_name)
+            continue
+        size += page_size
+        kept.add(content)
+    for name in os.listdir(pages_dir):
+        if name not in kept:
+            _remove(os.path.join(pages_dir, name))
+
+def _remove(file_name):
     try:
-        response = urllib.request.urlopen(req)
-        return response.read()
-    except urllib.error.HTTPError as e:
-        logger.info("{} could not be found".format(path))
-        return ""
+        os.remove(file_name)
+    except OSError:
+        pass